@@ -1,17 +1,42 @@
 from dotenv import load_dotenv
 load_dotenv()
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, send_from_directory
+import os
+if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    # prometheus_client enables multiprocess mode whenever the variable exists, even when empty
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+from flask import Flask, Response, stream_with_context, has_request_context, render_template, request, jsonify, session, g, redirect, url_for, flash, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.dialects import postgresql, sqlite
 from flask_wtf.csrf import CSRFProtect
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from werkzeug.security import generate_password_hash, check_password_hash
+from jinja2.sandbox import SandboxedEnvironment
+from prometheus_client import CollectorRegistry, Counter as MetricCounter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess, start_http_server
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta
-import os
+from collections import Counter, OrderedDict
+import io
+import csv
 import json
+import uuid
+import click
 import requests
 import math
 import re
+import time
+import queue
+import hashlib
+import hmac
+import atexit
+import select
+import heapq
+import threading
 import logging
 from logging.handlers import RotatingFileHandler
 from geopy.geocoders import Nominatim
@@ -26,6 +51,56 @@ app.config['GOOGLE_MAPS_API_KEY'] = os.environ.get('GOOGLE_MAPS_API_KEY', 'demo-
 # Feature flags - easily enable/disable features
 app.config['ENABLE_QUOTE_FEATURE'] = os.environ.get('ENABLE_QUOTE_FEATURE', 'False').lower() == 'true'
 
+# Background jobs - enable on exactly one process (e.g. a single gunicorn worker or a dedicated runner)
+app.config['ENABLE_BACKGROUND_JOBS'] = os.environ.get('ENABLE_BACKGROUND_JOBS', 'False').lower() == 'true'
+app.config['VENDOR_LOCATION_EXPIRY_INTERVAL'] = int(os.environ.get('VENDOR_LOCATION_EXPIRY_INTERVAL', 300))  # Seconds
+app.config['VENDOR_LOCATION_EXPIRY_BATCH_SIZE'] = int(os.environ.get('VENDOR_LOCATION_EXPIRY_BATCH_SIZE', 500))
+app.config['VENDOR_PING_MAX_BATCH'] = int(os.environ.get('VENDOR_PING_MAX_BATCH', 500))
+app.config['VENDOR_PING_DOWNSAMPLE_AFTER_HOURS'] = int(os.environ.get('VENDOR_PING_DOWNSAMPLE_AFTER_HOURS', 24))
+app.config['VENDOR_PING_DOWNSAMPLE_BUCKET_MINUTES'] = int(os.environ.get('VENDOR_PING_DOWNSAMPLE_BUCKET_MINUTES', 15))
+app.config['VENDOR_PING_RETENTION_DAYS'] = int(os.environ.get('VENDOR_PING_RETENTION_DAYS', 30))
+app.config['VENDOR_PING_DELETE_BATCH_SIZE'] = int(os.environ.get('VENDOR_PING_DELETE_BATCH_SIZE', 5000))
+app.config['VENDOR_PING_REGEOCODE_MILES'] = float(os.environ.get('VENDOR_PING_REGEOCODE_MILES', 15))
+app.config['VENDOR_COVERAGE_CELL_DEGREES'] = float(os.environ.get('VENDOR_COVERAGE_CELL_DEGREES', 0.5))
+app.config['VENDOR_COVERAGE_STATES'] = [state.strip().upper() for state in os.environ.get('VENDOR_COVERAGE_STATES', '').split(',') if state.strip()]  # Empty = lower 48 + DC
+app.config['LEAD_AUTO_ROUTING'] = os.environ.get('LEAD_AUTO_ROUTING', 'False').lower() == 'true'  # Opt in: otherwise new leads stay unassigned
+app.config['LEAD_ROUTING_ROLES'] = [role.strip() for role in os.environ.get('LEAD_ROUTING_ROLES', 'admin').split(',') if role.strip()]
+app.config['LEAD_ROUTING_FOLLOW_UP_WEIGHT'] = float(os.environ.get('LEAD_ROUTING_FOLLOW_UP_WEIGHT', 0.5))
+app.config['FOLLOW_UP_REMINDER_INTERVAL'] = int(os.environ.get('FOLLOW_UP_REMINDER_INTERVAL', 60))  # Seconds
+app.config['FOLLOW_UP_REMINDER_BATCH_SIZE'] = int(os.environ.get('FOLLOW_UP_REMINDER_BATCH_SIZE', 500))
+# 'memory' only reaches streams in the same process; 'postgres' (LISTEN/NOTIFY) is required once more than one process runs
+app.config['EVENT_BROKER_BACKEND'] = os.environ.get(
+    'EVENT_BROKER_BACKEND', 'postgres' if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres') else 'memory'
+)
+# Each open stream holds a worker thread: cap them per process and recycle them so polling and page requests keep a thread
+app.config['EVENT_STREAM_MAX_CONNECTIONS'] = int(os.environ.get('EVENT_STREAM_MAX_CONNECTIONS', 16))
+app.config['EVENT_STREAM_MAX_SECONDS'] = int(os.environ.get('EVENT_STREAM_MAX_SECONDS', 300))
+app.config['NOTIFICATION_RETENTION_DAYS'] = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', 90))  # Read notifications older than this
+app.config['NOTIFICATION_RETENTION_ACTION'] = os.environ.get('NOTIFICATION_RETENTION_ACTION', 'archive')  # 'archive', 'delete' or 'keep'
+app.config['NOTIFICATION_RETENTION_POLICY'] = os.environ.get('NOTIFICATION_RETENTION_POLICY', '')  # e.g. 'new_lead=delete:30,follow_up_due=delete:14'
+app.config['NOTIFICATION_RETENTION_BATCH_SIZE'] = int(os.environ.get('NOTIFICATION_RETENTION_BATCH_SIZE', 1000))
+app.config['EMAIL_OUTBOX_INTERVAL'] = int(os.environ.get('EMAIL_OUTBOX_INTERVAL', 5))  # Seconds
+app.config['EMAIL_OUTBOX_BATCH_SIZE'] = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', 100))
+app.config['EMAIL_MAX_ATTEMPTS'] = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 6))
+app.config['EMAIL_RETRY_BASE_SECONDS'] = int(os.environ.get('EMAIL_RETRY_BASE_SECONDS', 30))
+app.config['EMAIL_SMTP_IDLE_SECONDS'] = int(os.environ.get('EMAIL_SMTP_IDLE_SECONDS', 60))
+app.config['EMAIL_TEMPLATE_CACHE_TTL'] = int(os.environ.get('EMAIL_TEMPLATE_CACHE_TTL', 60))  # Seconds between updated_at checks
+app.config['AUDIT_LOG_MODE'] = os.environ.get('AUDIT_LOG_MODE', 'sync')  # 'sync' or 'async' (buffered writer)
+app.config['AUDIT_LOG_QUEUE_SIZE'] = int(os.environ.get('AUDIT_LOG_QUEUE_SIZE', 10000))
+app.config['AUDIT_LOG_FLUSH_INTERVAL_MS'] = int(os.environ.get('AUDIT_LOG_FLUSH_INTERVAL_MS', 500))
+app.config['AUDIT_LOG_FLUSH_BATCH_SIZE'] = int(os.environ.get('AUDIT_LOG_FLUSH_BATCH_SIZE', 200))
+app.config['VENDOR_IMPORT_CHUNK_SIZE'] = int(os.environ.get('VENDOR_IMPORT_CHUNK_SIZE', 500))
+app.config['VENDOR_IMPORT_POLL_INTERVAL'] = int(os.environ.get('VENDOR_IMPORT_POLL_INTERVAL', 10))  # Seconds between checks for queued imports
+app.config['SLOW_QUERY_THRESHOLD_MS'] = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))  # Log statements slower than this
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))  # Same statement shape this often in one request
+app.config['QUERY_STATS_HEADERS'] = os.environ.get('QUERY_STATS_HEADERS', 'False').lower() == 'true'  # Always on in debug mode
+app.config['QUERY_STATS_LOG_LEVEL'] = os.environ.get('QUERY_STATS_LOG_LEVEL', 'INFO').upper()  # Level of the per-request summary line
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')  # Bearer token for /metrics (super admins can always view it)
+app.config['WORKER_METRICS_PORT'] = int(os.environ.get('WORKER_METRICS_PORT', 9101))  # Background worker's own metrics endpoint, 0 disables it
+app.config['WORKER_METRICS_ADDR'] = os.environ.get('WORKER_METRICS_ADDR', '127.0.0.1')
+app.config['DISTANCE_CACHE_TTL'] = int(os.environ.get('DISTANCE_CACHE_TTL', 86400))  # Seconds
+app.config['DISTANCE_CACHE_SIZE'] = int(os.environ.get('DISTANCE_CACHE_SIZE', 5000))
+
 # Initialize extensions
 db = SQLAlchemy(app)
 csrf = CSRFProtect(app)
@@ -47,6 +122,131 @@ if not app.debug:
     app.logger.setLevel(logging.INFO)
     app.logger.info('Pilot Cars & Permits startup')
 
+# Prometheus metrics. Under gunicorn PROMETHEUS_MULTIPROC_DIR is set (see gunicorn.conf.py): every web
+# worker writes its samples to files in that directory and /metrics aggregates them across workers.
+# The background worker (SMTP, outbox and job metrics) serves its own registry on WORKER_METRICS_PORT.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency by endpoint',
+                            ['method', 'endpoint'], buckets=LATENCY_BUCKETS)
+REQUEST_COUNT = MetricCounter('http_requests_total', 'Requests by endpoint and status', ['method', 'endpoint', 'status'])
+REQUEST_DB_TIME = Histogram('http_request_db_duration_seconds', 'Time spent in SQL per request',
+                            ['endpoint'], buckets=LATENCY_BUCKETS)
+DB_QUERY_LATENCY = Histogram('db_query_duration_seconds', 'Duration of individual SQL statements', buckets=LATENCY_BUCKETS)
+OUTBOUND_LATENCY = Histogram('outbound_request_duration_seconds', 'Latency of calls to external providers',
+                             ['provider'], buckets=LATENCY_BUCKETS)
+OUTBOUND_ERRORS = MetricCounter('outbound_request_errors_total', 'Failed calls to external providers', ['provider'])
+CACHE_REQUESTS = MetricCounter('cache_requests_total', 'Cache lookups by cache and result (hit/miss)', ['cache', 'result'])
+
+@contextmanager
+def track_outbound(provider):
+    """Time a call to an external provider ('google', 'nominatim', 'smtp')"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        OUTBOUND_ERRORS.labels(provider).inc()
+        raise
+    finally:
+        OUTBOUND_LATENCY.labels(provider).observe(time.perf_counter() - started)
+
+def record_cache_lookup(cache, hits=0, misses=0):
+    if hits:
+        CACHE_REQUESTS.labels(cache, 'hit').inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(cache, 'miss').inc(misses)
+
+# Per-request SQL statistics: statement count, DB time, slow statements and repeated shapes (N+1)
+def statement_shape(statement):
+    """Normalize a statement so repeats that differ only in literals or IN-list length compare equal"""
+    shape = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    shape = re.sub(r'\b\d+(?:\.\d+)?\b', '?', shape)
+    shape = re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?)', shape)
+    return ' '.join(shape.split())
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query_timer(context):
+    # A failed statement never reaches after_cursor_execute: drop its start time so the stack stays aligned
+    connection = context.connection
+    if context.execution_context is not None and connection is not None and connection.info.get('query_start_time'):
+        connection.info['query_start_time'].pop()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_stats(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info['query_start_time'].pop()) * 1000
+    DB_QUERY_LATENCY.observe(elapsed_ms / 1000)
+    if not has_request_context():
+        return
+    stats = g.get('query_stats')
+    if stats is None:
+        return
+    stats['count'] += 1
+    stats['time_ms'] += elapsed_ms
+    stats['shapes'][statement_shape(statement)] += 1
+    if elapsed_ms >= app.config['SLOW_QUERY_THRESHOLD_MS']:
+        stats['slow'] += 1
+        app.logger.warning(f"Slow query ({elapsed_ms:.1f} ms) in {request.endpoint}: {' '.join(statement.split())[:500]}")
+
+@app.before_request
+def start_query_stats():
+    g.request_started = time.perf_counter()
+    g.query_stats = {'count': 0, 'time_ms': 0.0, 'slow': 0, 'shapes': Counter()}
+
+@app.after_request
+def report_query_stats(response):
+    stats = g.pop('query_stats', None)
+    if stats is None:
+        return response
+    total_ms = (time.perf_counter() - g.request_started) * 1000
+    REQUEST_DB_TIME.labels(request.endpoint or 'unmatched').observe(stats['time_ms'] / 1000)
+    summary = (f"{request.method} {request.path} [{request.endpoint}] {response.status_code}: "
+               f"{stats['count']} queries, {stats['time_ms']:.1f} ms DB, {total_ms:.1f} ms total")
+    repeated = [(count, shape) for shape, count in stats['shapes'].most_common()
+                if count >= app.config['N_PLUS_ONE_THRESHOLD']]
+    if repeated:
+        details = '; '.join(f"{count}x {shape if len(shape) <= 200 else shape[:80] + ' ... ' + shape[-120:]}"
+                            for count, shape in repeated[:3])
+        app.logger.warning(f"{summary}; possible N+1: {details}")
+    elif stats['slow']:
+        app.logger.warning(f"{summary}; {stats['slow']} slow queries")
+    else:
+        level = logging.getLevelName(app.config['QUERY_STATS_LOG_LEVEL'])
+        app.logger.log(level if isinstance(level, int) else logging.INFO, summary)
+    
+    if app.debug or app.config['QUERY_STATS_HEADERS']:
+        response.headers['X-Query-Count'] = str(stats['count'])
+        response.headers.add('Server-Timing', f'db;dur={stats["time_ms"]:.1f};desc="{stats["count"]} queries"')
+        response.headers.add('Server-Timing', f'app;dur={total_ms:.1f}')
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'  # Unrouted paths share one label
+        REQUEST_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - started)
+        REQUEST_COUNT.labels(request.method, endpoint, str(response.status_code)).inc()
+    return response
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics():
+    """Prometheus metrics (METRICS_TOKEN bearer token or a super admin session)"""
+    token = app.config['METRICS_TOKEN']
+    authorization = request.headers.get('Authorization', '')
+    if not (token and hmac.compare_digest(authorization, f'Bearer {token}')) and not has_permission(PERM_MANAGE_ADMINS):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+    
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
 
 # Add custom Jinja filters
 @app.template_filter('from_json')
@@ -96,7 +296,8 @@ def get_city_state_from_coordinates(latitude, longitude):
             'Accept-Language': 'en-US,en;q=0.9'
         }
         
-        response = requests.get(url, headers=headers, verify=False, timeout=10)
+        with track_outbound('nominatim'):
+            response = requests.get(url, headers=headers, verify=False, timeout=10)
         
         if response.status_code == 200:
             data = response.json()
@@ -159,7 +360,8 @@ def get_english_place_names(latitude, longitude, original_city, original_state):
             'Accept-Language': 'en-US,en;q=0.9'
         }
         
-        response = requests.get(url, headers=headers, verify=False, timeout=10)
+        with track_outbound('nominatim'):
+            response = requests.get(url, headers=headers, verify=False, timeout=10)
         
         if response.status_code == 200:
             data = response.json()
@@ -254,6 +456,67 @@ def get_english_place_names(latitude, longitude, original_city, original_state):
         print(f"English name lookup error: {e}")
         return None, None
 
+def normalize_geocode_key(city, state):
+    """Cache key for a US city/state pair"""
+    return f"{city.strip().lower()}, {state.strip().lower()}"
+
+def geocode_city_state(city, state):
+    """Forward geocode a US city/state pair with Nominatim, returning (latitude, longitude)"""
+    try:
+        url = "https://nominatim.openstreetmap.org/search"
+        params = {
+            'city': city,
+            'state': state,
+            'country': 'us',
+            'format': 'json',
+            'limit': 1
+        }
+        headers = {
+            'User-Agent': 'pilotcarsandpermits-app/1.0 (contact@pilotcarsandpermits.com)',
+            'Accept-Language': 'en-US,en;q=0.9'
+        }
+        
+        with track_outbound('nominatim'):
+            response = requests.get(url, params=params, headers=headers, timeout=10)
+        
+        if response.status_code == 200:
+            results = response.json()
+            if results:
+                return float(results[0]['lat']), float(results[0]['lon'])
+                
+    except Exception as e:
+        print(f"Forward geocoding error: {e}")
+    
+    return None, None
+
+def geocode_city_states_cached(city_states, request_interval=1.0):
+    """Batch geocode (city, state) pairs through the geocode_cache table
+    
+    Returns a dict keyed by normalize_geocode_key(). Cache misses are geocoded one
+    request per request_interval seconds (Nominatim usage policy) and stored, including
+    failed lookups, so the same address is never requested twice.
+    """
+    keys = {normalize_geocode_key(city, state): (city, state) for city, state in city_states}
+    results = {}
+    if not keys:
+        return results
+    
+    for cached in GeocodeCache.query.filter(GeocodeCache.address_key.in_(list(keys))).all():
+        results[cached.address_key] = (cached.latitude, cached.longitude)
+    
+    misses = [key for key in keys if key not in results]
+    record_cache_lookup('geocode', hits=len(results), misses=len(misses))
+    for index, key in enumerate(misses):
+        if index > 0:
+            time.sleep(request_interval)
+        latitude, longitude = geocode_city_state(*keys[key])
+        results[key] = (latitude, longitude)
+        db.session.add(GeocodeCache(address_key=key, latitude=latitude, longitude=longitude))
+    
+    if misses:
+        db.session.commit()
+    return results
+
 # Database Models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -268,12 +531,16 @@ class User(db.Model):
     user_type = db.Column(db.String(20), default='trucking_company')  # 'trucking_company' or 'vendor'
     is_approved = db.Column(db.Boolean, default=False)  # For trucking companies
     is_suspended = db.Column(db.Boolean, default=False)  # For suspension feature
+    claims_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped when session claims go stale
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     routes = db.relationship('SavedRoute', backref='user', lazy=True)
     quotes = db.relationship('Quote', backref='user', lazy=True)
     vendor_locations = db.relationship('VendorLocation', backref='user', lazy=True)
     pilot_car_orders = db.relationship('PilotCarOrder', backref='user', lazy=True)
 
+# Case-insensitive email lookups (profile update uniqueness check)
+db.Index('ix_user_email_lower', db.func.lower(User.email))
+
 class SavedRoute(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -290,6 +557,10 @@ class SavedRoute(db.Model):
     custom_route = db.Column(db.Text)
     route_results = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_saved_route_user_created', 'user_id', 'created_at'),
+    )
 
 class Quote(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -308,6 +579,10 @@ class Quote(db.Model):
     total_cost = db.Column(db.Float)
     quote_breakdown = db.Column(db.Text)  # JSON object
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_quote_user_created', 'user_id', 'created_at'),
+    )
 
 class VendorLocation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -327,6 +602,71 @@ class VendorLocation(db.Model):
     expires_at = db.Column(db.DateTime, nullable=False)  # 48 hours from creation
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+# Registered vendors have exactly one row, updated in place (guest shares are not constrained)
+db.Index('ux_vendor_location_registered_user', VendorLocation.user_id, unique=True,
+         postgresql_where=VendorLocation.is_registered_vendor == True,
+         sqlite_where=VendorLocation.is_registered_vendor == True)
+
+class VendorLocationHistory(db.Model):
+    """Archive of expired vendor location shares, kept for analytics"""
+    __tablename__ = 'vendor_location_history'
+    id = db.Column(db.Integer, primary_key=True)
+    location_id = db.Column(db.Integer, nullable=False)  # Original VendorLocation.id
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    company_name = db.Column(db.String(100), nullable=False)
+    contact_name = db.Column(db.String(100), nullable=True)
+    email = db.Column(db.String(120), nullable=False)
+    phone = db.Column(db.String(20), nullable=False)
+    location_city = db.Column(db.String(100), nullable=False)
+    location_state = db.Column(db.String(50), nullable=False)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    coverage_radius = db.Column(db.Integer, default=100)
+    services_provided = db.Column(db.Text, nullable=False)
+    notes = db.Column(db.Text, nullable=True)
+    is_registered_vendor = db.Column(db.Boolean, default=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class GeocodeCache(db.Model):
+    """Forward geocoding results keyed by normalized 'city, state' (null coordinates = not found)"""
+    __tablename__ = 'geocode_cache'
+    id = db.Column(db.Integer, primary_key=True)
+    address_key = db.Column(db.String(200), unique=True, nullable=False)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class VendorLocationPing(db.Model):
+    """Compact GPS time series for registered vendors (downsampled as it ages)"""
+    __tablename__ = 'vendor_location_ping'
+    __table_args__ = (
+        db.Index('ix_vendor_location_ping_user_ts', 'user_id', 'recorded_ts'),
+        db.Index('ix_vendor_location_ping_ts', 'recorded_ts'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    recorded_ts = db.Column(db.Integer, nullable=False)  # Unix epoch seconds
+
+# Progress of a vendor directory import, readable from any worker
+class VendorImportJob(db.Model):
+    __tablename__ = 'vendor_import_job'
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    users_created = db.Column(db.Integer, nullable=False, default=0)
+    locations_created = db.Column(db.Integer, nullable=False, default=0)
+    locations_updated = db.Column(db.Integer, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Text, nullable=False, default='[]')  # JSON list of {row, error}, capped
+    csv_data = db.Column(db.Text, nullable=True)  # Uploaded CSV until the worker finishes the import
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class PilotCarOrder(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # Nullable for guest orders
@@ -379,6 +719,11 @@ class PilotCarOrder(db.Model):
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_pilot_car_order_user_created', 'user_id', 'created_at'),
+        db.Index('ix_pilot_car_order_status_created', 'status', 'created_at'),
+    )
 
 # CRM Lead Model
 class Lead(db.Model):
@@ -402,6 +747,28 @@ class Lead(db.Model):
     company = db.relationship('User', foreign_keys=[company_id], backref='leads')
     assigned_admin = db.relationship('User', foreign_keys=[assigned_admin_id])
     actions = db.relationship('LeadAction', backref='lead', lazy=True, cascade='all, delete-orphan')
+    
+    activities = db.relationship('LeadActivity', backref='lead', lazy='dynamic', cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        db.Index('ix_lead_status_admin_created', 'status', 'assigned_admin_id', 'created_at'),
+        db.Index('ix_lead_admin_created', 'assigned_admin_id', 'created_at'),
+        db.Index('ix_lead_created_at', 'created_at'),
+        db.Index('ix_lead_company_status', 'company_id', 'status'),
+    )
+
+# Append-only log of customer activity (quotes, load plans) that fed a lead
+class LeadActivity(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    lead_id = db.Column(db.Integer, db.ForeignKey('lead.id'), nullable=False)
+    lead_source = db.Column(db.String(50), nullable=False)  # 'quote_request', 'load_plan', 'contact_form'
+    estimated_value = db.Column(db.Float, default=0.0)
+    notes = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_lead_activity_lead_created', 'lead_id', 'created_at'),
+    )
 
 class LeadAction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -415,6 +782,67 @@ class LeadAction(db.Model):
     
     # Relationships
     admin = db.relationship('User', backref='lead_actions')
+    
+    __table_args__ = (
+        db.Index('ix_lead_action_admin_follow_up', 'admin_id', 'follow_up_date'),
+        db.Index('ix_lead_action_follow_up', 'follow_up_date'),
+    )
+
+# Time-ordered queue of follow-up reminders; rows are removed once the reminder is sent
+class FollowUpReminder(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    action_id = db.Column(db.Integer, db.ForeignKey('lead_action.id'), nullable=False, unique=True)
+    lead_id = db.Column(db.Integer, db.ForeignKey('lead.id'), nullable=False)
+    admin_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    due_at = db.Column(db.DateTime, nullable=False, index=True)
+
+# KPI rollups - daily pre-aggregates maintained on write (see KPI ROLLUPS section)
+class DailyOrderRollup(db.Model):
+    __tablename__ = 'daily_order_rollup'
+    day = db.Column(db.Date, primary_key=True)  # Order creation day
+    status = db.Column(db.String(20), primary_key=True)  # Current order status
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+
+class DailyLeadRollup(db.Model):
+    __tablename__ = 'daily_lead_rollup'
+    day = db.Column(db.Date, primary_key=True)  # Lead creation day
+    status = db.Column(db.String(20), primary_key=True)  # Current lead status
+    assigned_admin_id = db.Column(db.Integer, primary_key=True)  # 0 = unassigned
+    lead_count = db.Column(db.Integer, nullable=False, default=0)
+    conversion_value = db.Column(db.Float, nullable=False, default=0.0)
+
+class DailyQuoteRollup(db.Model):
+    __tablename__ = 'daily_quote_rollup'
+    day = db.Column(db.Date, primary_key=True)  # Quote creation day
+    region = db.Column(db.String(50), primary_key=True)  # '' = unknown region
+    quote_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+# Open-lead workload per admin, maintained with the KPI rollups and used by the lead router
+class AdminLeadLoad(db.Model):
+    __tablename__ = 'admin_lead_load'
+    admin_id = db.Column(db.Integer, primary_key=True)
+    open_leads = db.Column(db.Integer, nullable=False, default=0)  # assigned + in_progress
+    follow_ups = db.Column(db.Integer, nullable=False, default=0)  # open leads with a follow-up scheduled
+
+# Version of each one-off data rebuild applied to this database (see upgrade_database)
+class MaintenanceMarker(db.Model):
+    __tablename__ = 'maintenance_marker'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Last run of each background job; jobs run in the worker process, so this is how web processes see them
+class BackgroundJobRun(db.Model):
+    __tablename__ = 'background_job_run'
+    name = db.Column(db.String(100), primary_key=True)
+    runs = db.Column(db.Integer, nullable=False, default=0)
+    last_run_at = db.Column(db.DateTime)
+    last_duration_ms = db.Column(db.Float)
+    last_error = db.Column(db.Text)
+    last_result = db.Column(db.Text)  # JSON of the job's return value
+    total_processed = db.Column(db.Integer, nullable=False, default=0)  # Sum of integer results (e.g. rows expired)
+    cursor = db.Column(db.BigInteger)  # Where the job resumes next run (e.g. a timestamp watermark)
 
 # Notification Model
 class Notification(db.Model):
@@ -429,6 +857,33 @@ class Notification(db.Model):
     
     # Relationships
     user = db.relationship('User', backref='notifications')
+    
+    __table_args__ = (
+        db.Index('ix_notification_user_read_created', 'user_id', 'is_read', 'created_at'),
+        db.Index('ix_notification_read_created', 'is_read', 'created_at'),
+    )
+
+# Compact archive of read notifications moved out by the retention job
+class NotificationArchive(db.Model):
+    __tablename__ = 'notification_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    notification_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    type = db.Column(db.String(50), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_notification_archive_user_created', 'user_id', 'created_at'),
+    )
+
+# Per-user unread notification count, maintained with the KPI rollups
+class NotificationUnreadCount(db.Model):
+    __tablename__ = 'notification_unread_count'
+    user_id = db.Column(db.Integer, primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
 
 # Email Template Model
 class EmailTemplate(db.Model):
@@ -440,7 +895,31 @@ class EmailTemplate(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-# User Audit Log Model
+@event.listens_for(EmailTemplate, 'after_insert')
+@event.listens_for(EmailTemplate, 'after_update')
+@event.listens_for(EmailTemplate, 'after_delete')
+def invalidate_email_template_cache(mapper, connection, target):
+    EmailService.invalidate_template_cache(target.template_name)
+
+# Durable queue of outgoing email, drained by the deliver_email_outbox background job
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(120), nullable=False)
+    template_name = db.Column(db.String(100), nullable=False)
+    template_vars = db.Column(db.Text, nullable=True)  # JSON object
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+# Legacy audit log table; 'flask migrate-audit-log' moves its rows into AuditEvent
 class UserAuditLog(db.Model):
     __tablename__ = 'user_audit_log'
     id = db.Column(db.Integer, primary_key=True)
@@ -460,6 +939,41 @@ class UserAuditLog(db.Model):
     user = db.relationship('User', foreign_keys=[user_id], backref='audit_logs')
     admin_user = db.relationship('User', foreign_keys=[admin_user_id])
 
+# Interned audit dimensions: each distinct IP address / user agent is stored once
+class AuditIpAddress(db.Model):
+    __tablename__ = 'audit_ip_address'
+    id = db.Column(db.Integer, primary_key=True)
+    ip_address = db.Column(db.String(45), unique=True, nullable=False)
+
+class AuditUserAgent(db.Model):
+    __tablename__ = 'audit_user_agent'
+    id = db.Column(db.Integer, primary_key=True)
+    ua_hash = db.Column(db.String(64), unique=True, nullable=False)  # sha256 of user_agent
+    user_agent = db.Column(db.Text, nullable=False)
+
+# Audit events, bucketed by month (YYYYMM) so old months can be archived or dropped in one range
+class AuditEvent(db.Model):
+    __tablename__ = 'audit_event'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    action_type = db.Column(db.String(50), nullable=False)  # 'login', 'profile_update', 'password_change', 'status_change'
+    action_description = db.Column(db.Text, nullable=False)
+    field_changed = db.Column(db.String(50), nullable=True)
+    old_value = db.Column(db.Text, nullable=True)
+    new_value = db.Column(db.Text, nullable=True)
+    changed_by_admin = db.Column(db.Boolean, default=False)
+    admin_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    ip_address_id = db.Column(db.Integer, db.ForeignKey('audit_ip_address.id'), nullable=True)
+    user_agent_id = db.Column(db.Integer, db.ForeignKey('audit_user_agent.id'), nullable=True)
+    month_bucket = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_audit_event_user_created', 'user_id', 'created_at'),
+        db.Index('ix_audit_event_created', 'created_at'),
+        db.Index('ix_audit_event_month_bucket', 'month_bucket'),
+    )
+
 # Blog Post Model for SEO-friendly blog system
 class BlogPost(db.Model):
     __tablename__ = 'blog_post'
@@ -506,6 +1020,10 @@ class BlogPost(db.Model):
     # Relationships
     author = db.relationship('User', backref='blog_posts')
     
+    __table_args__ = (
+        db.Index('ix_blog_post_status_published', 'status', 'published_at'),
+    )
+    
     def __init__(self, **kwargs):
         super(BlogPost, self).__init__(**kwargs)
         if not self.slug and self.title:
@@ -595,88 +1113,163 @@ class BlogPost(db.Model):
 class EmailService:
     @staticmethod
     def send_email_notification(to_email, template_name, template_vars=None):
-        """Send email notification using template"""
+        """Queue an email notification with the caller's transaction; the outbox worker sends it after commit"""
         try:
-            # Check if we're in production mode
-            is_production = os.getenv('FLASK_ENV') == 'production'
-            
-            if not is_production:
-                # Development mode - just log the email
-                print(f"\n{'='*60}")
-                print(f"📧 EMAIL NOTIFICATION (Development Mode)")
-                print(f"{'='*60}")
-                print(f"To: {to_email}")
-                print(f"Template: {template_name}")
-                if template_vars:
-                    print(f"Variables: {template_vars}")
-                print(f"{'='*60}\n")
-                return True
-            
-            # Production mode - send actual email
-            from flask_mail import Mail, Message
-            
-            # Initialize Flask-Mail if not already done
-            if not hasattr(EmailService, '_mail'):
-                mail = Mail()
-                app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
-                app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 587))
-                app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', 'true').lower() == 'true'
-                app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
-                app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
-                app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
-                mail.init_app(app)
-                EmailService._mail = mail
-            
-            # Get email template
-            template = EmailTemplate.query.filter_by(template_name=template_name).first()
-            if not template:
-                print(f"Email template '{template_name}' not found")
-                return False
-            
-            # Render template with variables
-            subject = template.subject
-            html_content = template.html_content
-            text_content = template.text_content or ''
-            
-            if template_vars:
-                for key, value in template_vars.items():
-                    placeholder = f"{{{{ {key} }}}}"
-                    subject = subject.replace(placeholder, str(value))
-                    html_content = html_content.replace(placeholder, str(value))
-                    text_content = text_content.replace(placeholder, str(value))
-            
-            # Create and send message
-            msg = Message(
-                subject=subject,
-                recipients=[to_email],
-                html=html_content,
-                body=text_content,
-                sender=app.config['MAIL_DEFAULT_SENDER']
-            )
-            
-            EmailService._mail.send(msg)
+            # Savepoint: a failed enqueue must not roll back the caller's work
+            with db.session.begin_nested():
+                EmailService.enqueue([to_email], template_name, template_vars)
             return True
-            
         except Exception as e:
-            app.logger.error(f"Error sending email: {e}")
+            app.logger.error(f"Error queueing email: {e}")
             return False
     
     @staticmethod
     def send_admin_notification(template_name, template_vars=None):
-        """Send notification to all admin users"""
-        admin_users = User.query.filter(User.is_admin == True).all()
-        success_count = 0
+        """Queue a notification email to all admin users with the caller's transaction"""
+        try:
+            with db.session.begin_nested():
+                admin_emails = db.session.scalars(db.select(User.email).where(User.is_admin == True)).all()
+                return EmailService.enqueue(admin_emails, template_name, template_vars) > 0
+        except Exception as e:
+            app.logger.error(f"Error queueing admin emails: {e}")
+            return False
+    
+    @staticmethod
+    def enqueue(recipients, template_name, template_vars=None):
+        """Insert one outbox row per recipient with a single executemany (caller commits)
+        
+        The rows become visible to the outbox worker only when the caller's transaction
+        commits, so a rolled back request never sends its emails.
+        """
+        if not recipients:
+            return 0
+        now = datetime.utcnow()
+        payload = json.dumps(template_vars or {}, default=str)
+        db.session.execute(db.insert(EmailOutbox), [{
+            'to_email': recipient,
+            'template_name': template_name,
+            'template_vars': payload,
+            'status': 'pending',
+            'attempts': 0,
+            'next_attempt_at': now,
+            'created_at': now
+        } for recipient in recipients])
+        return len(recipients)
+    
+    # Compiled templates: {template_name: {'updated_at', 'checked_at', 'subject', 'html', 'text'}}
+    _template_cache = {}
+    _html_env = SandboxedEnvironment(autoescape=True)
+    _text_env = SandboxedEnvironment(autoescape=False)
+    
+    @staticmethod
+    def get_compiled_template(template_name):
+        """Compiled subject/html/text for a stored template, cached by name and updated_at
+        
+        A cached entry is trusted for EMAIL_TEMPLATE_CACHE_TTL seconds, then revalidated
+        with a single updated_at lookup and recompiled only if the template changed.
+        """
+        cached = EmailService._template_cache.get(template_name)
+        now = time.monotonic()
+        if cached and now - cached['checked_at'] < app.config['EMAIL_TEMPLATE_CACHE_TTL']:
+            return cached
+        
+        if cached:
+            updated_at = db.session.scalar(
+                db.select(EmailTemplate.updated_at).where(EmailTemplate.template_name == template_name)
+            )
+            if updated_at is not None and updated_at == cached['updated_at']:
+                cached['checked_at'] = now
+                return cached
         
-        for admin in admin_users:
-            if EmailService.send_email_notification(admin.email, template_name, template_vars):
-                success_count += 1
+        template = EmailTemplate.query.filter_by(template_name=template_name).first()
+        if not template:
+            EmailService._template_cache.pop(template_name, None)
+            return None
         
-        return success_count > 0
+        compiled = {
+            'updated_at': template.updated_at,
+            'checked_at': now,
+            'subject': EmailService._text_env.from_string(template.subject),
+            'html': EmailService._html_env.from_string(template.html_content),
+            'text': EmailService._text_env.from_string(template.text_content or '')
+        }
+        EmailService._template_cache[template_name] = compiled
+        return compiled
+    
+    @staticmethod
+    def invalidate_template_cache(template_name=None):
+        """Drop one compiled template (or all of them)"""
+        if template_name is None:
+            EmailService._template_cache.clear()
+        else:
+            EmailService._template_cache.pop(template_name, None)
+    
+    @staticmethod
+    def render_many(template_name, template_vars_list):
+        """Render one template for many recipients; returns [(subject, html, text)] or None"""
+        compiled = EmailService.get_compiled_template(template_name)
+        if compiled is None:
+            return None
+        return [EmailService.render_compiled(compiled, template_vars) for template_vars in template_vars_list]
+    
+    @staticmethod
+    def render_compiled(compiled, template_vars=None):
+        """Render a template from get_compiled_template into (subject, html, text)"""
+        template_vars = template_vars or {}
+        return (
+            compiled['subject'].render(template_vars),
+            compiled['html'].render(template_vars),
+            compiled['text'].render(template_vars)
+        )
+    
+    @staticmethod
+    def render(template_name, template_vars=None):
+        """Render a stored template into (subject, html, text), or None if it does not exist"""
+        rendered = EmailService.render_many(template_name, [template_vars])
+        return rendered[0] if rendered else None
+    
+    @staticmethod
+    def get_mail():
+        """Flask-Mail instance, configured on first use"""
+        from flask_mail import Mail
+        
+        if not hasattr(EmailService, '_mail'):
+            mail = Mail()
+            app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
+            app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 587))
+            app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', 'true').lower() == 'true'
+            app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
+            app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
+            app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
+            mail.init_app(app)
+            EmailService._mail = mail
+        return EmailService._mail
+
+STATE_REGULATIONS_PATH = 'static/js/state_regulations.js'
+
+# Parsed regulations, reused until the source file's mtime changes
+state_regulations_cache = {'mtime': None, 'regulations': None}
 
 def load_state_regulations():
+    """State regulations by state abbreviation (parsed once per version of the JavaScript file)"""
+    try:
+        mtime = os.path.getmtime(STATE_REGULATIONS_PATH)
+    except OSError:
+        mtime = None
+    if state_regulations_cache['regulations'] and state_regulations_cache['mtime'] == mtime:
+        record_cache_lookup('regulations', hits=1)
+        return state_regulations_cache['regulations']
+    
+    record_cache_lookup('regulations', misses=1)
+    regulations = parse_state_regulations()
+    if regulations:
+        state_regulations_cache.update(mtime=mtime, regulations=regulations)
+    return regulations
+
+def parse_state_regulations():
     """Load state regulations from the JavaScript file"""
     try:
-        with open('static/js/state_regulations.js', 'r') as f:
+        with open(STATE_REGULATIONS_PATH, 'r') as f:
             content = f.read()
             
             # Find the array start after the const declaration
@@ -908,7 +1501,32 @@ def get_regional_rates():
         }
     }
 
+# (origin, destination) -> (distance_miles, cached_at); only successful lookups are kept
+distance_cache = OrderedDict()
+distance_cache_lock = threading.Lock()
+
 def calculate_distance_google_api(origin, destination):
+    """Distance in miles between two places, served from distance_cache for DISTANCE_CACHE_TTL seconds"""
+    key = (' '.join(origin.lower().split()), ' '.join(destination.lower().split()))
+    now = time.monotonic()
+    with distance_cache_lock:
+        cached = distance_cache.get(key)
+        if cached and now - cached[1] < app.config['DISTANCE_CACHE_TTL']:
+            distance_cache.move_to_end(key)
+            record_cache_lookup('distance', hits=1)
+            return cached[0]
+    record_cache_lookup('distance', misses=1)
+    
+    distance_miles = fetch_distance_google_api(origin, destination)
+    if distance_miles is not None:
+        with distance_cache_lock:
+            distance_cache[key] = (distance_miles, now)
+            distance_cache.move_to_end(key)
+            while len(distance_cache) > app.config['DISTANCE_CACHE_SIZE']:
+                distance_cache.popitem(last=False)
+    return distance_miles
+
+def fetch_distance_google_api(origin, destination):
     """Calculate distance using Google Maps Distance Matrix API"""
     try:
         api_key = os.environ.get('GOOGLE_MAPS_API_KEY', 'your-api-key-here') 
@@ -921,7 +1539,8 @@ def calculate_distance_google_api(origin, destination):
             'key': api_key
         }
         
-        response = requests.get(url, params=params, timeout=10)
+        with track_outbound('google'):
+            response = requests.get(url, params=params, timeout=10)
         data = response.json()
         
         if data['status'] == 'OK' and data['rows'][0]['elements'][0]['status'] == 'OK':
@@ -1134,251 +1753,1066 @@ def calculate_quote(quote_data):
 
 # ================== AUDIT LOG FUNCTIONS ==================
 
+AUDIT_EVENT_COLUMNS = (
+    'user_id', 'action_type', 'action_description', 'field_changed', 'old_value',
+    'new_value', 'changed_by_admin', 'admin_user_id', 'created_at'
+)
+AUDIT_DIMENSION_CACHE_SIZE = 10000
+
+# value -> id for interned IP addresses ('ip') and user agent hashes ('ua')
+audit_dimension_cache = {'ip': {}, 'ua': {}}
+
+def reset_audit_dimension_cache():
+    """Forget cached ids (after a failed write they may belong to a rolled-back insert)"""
+    for cache in audit_dimension_cache.values():
+        cache.clear()
+
+def _intern_audit_values(connection, cache_name, model, key_column, rows_by_key):
+    """Return the id cache for model after making sure every key in rows_by_key has a row"""
+    cache = audit_dimension_cache[cache_name]
+    missing = [key for key in rows_by_key if key not in cache]
+    if not missing:
+        return cache
+    
+    table = model.__table__
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        connection.execute(insert(table).on_conflict_do_nothing(index_elements=[key_column]),
+                           [rows_by_key[key] for key in missing])
+    else:
+        existing = set(connection.scalars(db.select(table.c[key_column]).where(table.c[key_column].in_(missing))))
+        new_rows = [rows_by_key[key] for key in missing if key not in existing]
+        if new_rows:
+            connection.execute(table.insert(), new_rows)
+    
+    if len(cache) + len(missing) > AUDIT_DIMENSION_CACHE_SIZE:
+        cache.clear()
+    for row_id, key in connection.execute(
+        db.select(table.c.id, table.c[key_column]).where(table.c[key_column].in_(missing))
+    ):
+        cache[key] = row_id
+    return cache
+
+def write_audit_rows(connection, rows):
+    """Insert audit rows as AuditEvents with one multi-row INSERT, interning IPs and user agents"""
+    ip_rows = {row['ip_address']: {'ip_address': row['ip_address']} for row in rows if row.get('ip_address')}
+    ua_hashes = {}
+    ua_rows = {}
+    for index, row in enumerate(rows):
+        if row.get('user_agent'):
+            ua_hash = hashlib.sha256(row['user_agent'].encode('utf-8')).hexdigest()
+            ua_hashes[index] = ua_hash
+            ua_rows[ua_hash] = {'ua_hash': ua_hash, 'user_agent': row['user_agent']}
+    ip_ids = _intern_audit_values(connection, 'ip', AuditIpAddress, 'ip_address', ip_rows)
+    ua_ids = _intern_audit_values(connection, 'ua', AuditUserAgent, 'ua_hash', ua_rows)
+    
+    events = []
+    for index, row in enumerate(rows):
+        event = {column: row.get(column) for column in AUDIT_EVENT_COLUMNS}
+        event['created_at'] = event['created_at'] or datetime.utcnow()
+        event['changed_by_admin'] = bool(event['changed_by_admin'])
+        event['ip_address_id'] = ip_ids.get(row['ip_address']) if row.get('ip_address') else None
+        event['user_agent_id'] = ua_ids.get(ua_hashes[index]) if index in ua_hashes else None
+        event['month_bucket'] = event['created_at'].year * 100 + event['created_at'].month
+        events.append(event)
+    connection.execute(AuditEvent.__table__.insert(), events)
+
+class AuditLogWriter:
+    """Buffers audit rows in a bounded queue and writes them from a background thread
+    
+    Rows are flushed as one multi-row INSERT every AUDIT_LOG_FLUSH_INTERVAL_MS or as soon
+    as AUDIT_LOG_FLUSH_BATCH_SIZE rows are waiting. When the queue is full the caller
+    writes its row synchronously instead of dropping it. close() drains the queue and
+    runs at interpreter exit; rows still queued when a process is killed are lost.
+    
+    A failed batch is retried once, then written row by row so one bad row only
+    loses itself (it is logged in full).
+    """
+    
+    def __init__(self, max_queue_size, flush_interval_ms, batch_size):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.batch_size = batch_size
+        self.stats = {'written': 0, 'batches': 0, 'sync_fallbacks': 0, 'errors': 0, 'dropped': 0}
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+    
+    def submit(self, row):
+        self._start()
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self.stats['sync_fallbacks'] += 1
+            self._write([row])
+    
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        while True:
+            rows = self._drain(self.batch_size)
+            if not rows:
+                break
+            self._write(rows)
+    
+    def close(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+    
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+                self._thread.start()
+    
+    def _drain(self, limit):
+        rows = []
+        while len(rows) < limit:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+    
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                rows = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            # Collect whatever else arrives within the flush window, up to one batch
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(rows)
+    
+    def _write(self, rows):
+        for attempt in range(2):
+            if attempt:
+                time.sleep(self.flush_interval)
+            if self._insert(rows):
+                self.stats['written'] += len(rows)
+                self.stats['batches'] += 1
+                return
+        
+        # Still failing: isolate the rows that cannot be written
+        for row in rows:
+            if self._insert([row]):
+                self.stats['written'] += 1
+            else:
+                self.stats['dropped'] += 1
+                app.logger.error(f"Dropped audit log entry: {json.dumps(row, default=str)}")
+    
+    def _insert(self, rows):
+        try:
+            with app.app_context():
+                with db.engine.begin() as connection:
+                    write_audit_rows(connection, rows)
+            return True
+        except Exception as e:
+            self.stats['errors'] += 1
+            # Cached dimension ids may belong to the rolled back insert
+            reset_audit_dimension_cache()
+            app.logger.error(f"Error writing {len(rows)} audit log entries: {e}")
+            return False
+
+audit_log_writer = AuditLogWriter(
+    app.config['AUDIT_LOG_QUEUE_SIZE'],
+    app.config['AUDIT_LOG_FLUSH_INTERVAL_MS'],
+    app.config['AUDIT_LOG_FLUSH_BATCH_SIZE']
+)
+atexit.register(audit_log_writer.close)
+
 def create_audit_log(user_id, action_type, action_description, field_changed=None, 
                     old_value=None, new_value=None, changed_by_admin=False, 
                     admin_user_id=None, ip_address=None, user_agent=None):
-    """Create an audit log entry"""
+    """Record an audit log entry
+    
+    'sync' mode (default) inserts and commits immediately. In 'async' mode the entry is
+    queued for the buffered writer and the request does not wait for a commit.
+    """
     try:
-        audit_log = UserAuditLog(
-            user_id=user_id,
-            action_type=action_type,
-            action_description=action_description,
-            field_changed=field_changed,
-            old_value=old_value,
-            new_value=new_value,
-            changed_by_admin=changed_by_admin,
-            admin_user_id=admin_user_id,
-            ip_address=ip_address,
-            user_agent=user_agent
-        )
-        db.session.add(audit_log)
-        db.session.commit()
-        return audit_log
+        row = {
+            'user_id': user_id,
+            'action_type': action_type,
+            'action_description': action_description,
+            'field_changed': field_changed,
+            'old_value': old_value,
+            'new_value': new_value,
+            'changed_by_admin': changed_by_admin,
+            'admin_user_id': admin_user_id,
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'created_at': datetime.utcnow()
+        }
+        if app.config['AUDIT_LOG_MODE'] == 'sync':
+            write_audit_rows(db.session.connection(), [row])
+            db.session.commit()
+        else:
+            audit_log_writer.submit(row)
+        return row
     except Exception as e:
         print(f"Error creating audit log: {str(e)}")
         db.session.rollback()
+        reset_audit_dimension_cache()
         return None
 
-# Authentication decorator
-def login_required(f):
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return redirect(url_for('login'))
-        
-        # Check if user is suspended
-        user = User.query.get(session['user_id'])
-        if user and user.is_suspended:
-            session.clear()
-            flash('Your account has been suspended. Please contact support.')
-            return redirect(url_for('login'))
-            
-        return f(*args, **kwargs)
-    decorated_function.__name__ = f.__name__
-    return decorated_function
-
-def trucking_company_required(f):
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return redirect(url_for('login'))
-        
-        user = User.query.get(session['user_id'])
-        if not user:
-            session.clear()
-            return redirect(url_for('login'))
-            
-        if user.is_suspended:
-            session.clear()
-            flash('Your account has been suspended. Please contact support.')
-            return redirect(url_for('login'))
-            
-        if user.user_type != 'trucking_company':
-            flash('This feature is only available to trucking companies.')
-            return redirect(url_for('dashboard'))
-            
-        if not user.is_approved and not user.is_admin:
-            flash('Your account is pending approval. Please wait for admin approval.')
-            return redirect(url_for('dashboard'))
-            
-        return f(*args, **kwargs)
-    decorated_function.__name__ = f.__name__
-    return decorated_function
+def audit_event_query(user_id=None, action_type=None):
+    """AuditEvents with their IP, user agent and acting admin resolved"""
+    admin_user = db.aliased(User)
+    query = db.session.query(
+        AuditEvent,
+        AuditIpAddress.ip_address,
+        AuditUserAgent.user_agent,
+        db.func.coalesce(admin_user.contact_name, admin_user.company_name)
+    ).outerjoin(AuditIpAddress, AuditEvent.ip_address_id == AuditIpAddress.id)\
+        .outerjoin(AuditUserAgent, AuditEvent.user_agent_id == AuditUserAgent.id)\
+        .outerjoin(admin_user, AuditEvent.admin_user_id == admin_user.id)
+    if user_id is not None:
+        query = query.filter(AuditEvent.user_id == user_id)
+    if action_type:
+        query = query.filter(AuditEvent.action_type == action_type)
+    return query
+
+def serialize_audit_event(row):
+    event, ip_address, user_agent, admin_name = row
+    return {
+        'id': event.id,
+        'user_id': event.user_id,
+        'action_type': event.action_type,
+        'action_description': event.action_description,
+        'field_changed': event.field_changed,
+        'old_value': event.old_value,
+        'new_value': event.new_value,
+        'changed_by_admin': event.changed_by_admin,
+        'admin_name': admin_name or ('Admin' if event.changed_by_admin else None),
+        'ip_address': ip_address,
+        'user_agent': user_agent,
+        'created_at': event.created_at.isoformat(),
+        'time_ago': get_time_ago(event.created_at)
+    }
 
-def vendor_required(f):
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return redirect(url_for('login'))
-        
-        user = User.query.get(session['user_id'])
-        if not user:
-            session.clear()
-            return redirect(url_for('login'))
-            
-        if user.is_suspended:
-            session.clear()
-            flash('Your account has been suspended. Please contact support.')
-            return redirect(url_for('login'))
-            
-        if user.user_type != 'vendor':
-            flash('This feature is only available to vendors.')
-            return redirect(url_for('dashboard'))
-            
-        return f(*args, **kwargs)
-    decorated_function.__name__ = f.__name__
-    return decorated_function
-
-def admin_required(f):
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
-        if not user or not user.is_admin:
-            flash('Admin access required')
-            return redirect(url_for('dashboard'))
-        return f(*args, **kwargs)
-    decorated_function.__name__ = f.__name__
-    return decorated_function
-
-def admin_or_super_admin_required(f):
-    """Allow access to admin and super admin roles only (excludes dispatchers)"""
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
-        if not user or not user.is_admin:
-            flash('Admin access required')
-            return redirect(url_for('dashboard'))
-        # Check if user has admin or super_admin role (exclude dispatchers)
-        if user.admin_role not in ['admin', 'super_admin']:
-            flash('Access denied. You do not have permission to access this feature.')
-            return redirect(url_for('dashboard'))
-        return f(*args, **kwargs)
-    decorated_function.__name__ = f.__name__
-    return decorated_function
-
-def dispatcher_or_higher_required(f):
-    """Allow access to dispatcher, admin, and super admin roles"""
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
-        if not user or not user.is_admin:
-            flash('Staff access required')
-            return redirect(url_for('dashboard'))
-        # Allow dispatchers, admin, and super_admin roles
-        if user.admin_role not in ['dispatcher', 'admin', 'super_admin']:
-            flash('Access denied. You do not have permission to access this feature.')
-            return redirect(url_for('dashboard'))
-        return f(*args, **kwargs)
-    decorated_function.__name__ = f.__name__
-    return decorated_function
-
-def dispatcher_or_trucking_company_required(f):
-    """Allow access to dispatchers and approved trucking companies for load planning"""
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
-        
-        # Allow trucking companies OR admin staff (dispatcher, admin, super_admin)
-        if user and ((user.user_type == 'trucking_company' and user.is_approved) or 
-                    (user.is_admin and user.admin_role in ['dispatcher', 'admin', 'super_admin'])):
-            return f(*args, **kwargs)
-        
-        if user and user.user_type == 'trucking_company' and not user.is_approved:
-            flash('Your account is pending approval. Please wait for admin approval to access this feature.', 'warning')
-            return redirect(url_for('dashboard'))
+@app.cli.command('migrate-audit-log')
+@click.option('--batch-size', default=1000, show_default=True)
+def migrate_audit_log_command(batch_size):
+    """Move legacy user_audit_log rows into the interned, month-bucketed audit_event table"""
+    migrated = 0
+    while True:
+        legacy_rows = UserAuditLog.query.order_by(UserAuditLog.id).limit(batch_size).all()
+        if not legacy_rows:
+            break
+        write_audit_rows(db.session.connection(), [{
+            'user_id': row.user_id,
+            'action_type': row.action_type,
+            'action_description': row.action_description,
+            'field_changed': row.field_changed,
+            'old_value': row.old_value,
+            'new_value': row.new_value,
+            'changed_by_admin': row.changed_by_admin,
+            'admin_user_id': row.admin_user_id,
+            'ip_address': row.ip_address,
+            'user_agent': row.user_agent,
+            'created_at': row.created_at
+        } for row in legacy_rows])
+        db.session.execute(db.delete(UserAuditLog).where(UserAuditLog.id.in_([row.id for row in legacy_rows])))
+        db.session.commit()
+        migrated += len(legacy_rows)
+    print(f"Migrated {migrated} audit log entries")
+
+# ================== BACKGROUND JOBS ==================
+
+background_jobs = {}
+_background_jobs_started = False
+
+def register_background_job(name, interval_seconds, func):
+    """Register a function to run periodically inside an app context"""
+    background_jobs[name] = {
+        'func': func,
+        'interval': interval_seconds
+    }
+
+def record_background_job_run(name, finished_at, duration_ms, result=None, error=None):
+    """Store one run in BackgroundJobRun (a single worker process runs the jobs, so no write races)"""
+    run = db.session.get(BackgroundJobRun, name) or BackgroundJobRun(name=name, runs=0, total_processed=0)
+    run.runs += 1
+    run.last_run_at = finished_at
+    run.last_duration_ms = round(duration_ms, 1)
+    run.last_error = error
+    run.last_result = json.dumps(result, default=str) if error is None else None
+    if isinstance(result, int) and not isinstance(result, bool):
+        run.total_processed += result
+    db.session.add(run)
+    db.session.commit()
+
+def run_background_job(name):
+    """Run a registered job once, isolating failures from the caller, and record the run"""
+    job = background_jobs[name]
+    with app.app_context():
+        started = time.perf_counter()
+        result = error = None
+        try:
+            result = job['func']()
+        except Exception as e:
+            app.logger.error(f"Background job '{name}' failed: {e}")
+            error = str(e)
+            db.session.rollback()
+        try:
+            record_background_job_run(name, datetime.utcnow(), (time.perf_counter() - started) * 1000, result, error)
+        except Exception as e:
+            app.logger.error(f"Could not record background job '{name}': {e}")
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+def _background_job_loop(name):
+    while True:
+        time.sleep(background_jobs[name]['interval'])
+        run_background_job(name)
+
+def start_background_jobs():
+    """Start one daemon thread per registered job (idempotent)"""
+    global _background_jobs_started
+    if _background_jobs_started:
+        return
+    _background_jobs_started = True
+    with app.app_context():
+        # Jobs run in a single process, so anything still 'running' was cut off by its restart
+        fail_interrupted_vendor_import_jobs()
+        db.session.remove()
+    for name in background_jobs:
+        thread = threading.Thread(target=_background_job_loop, args=(name,), name=f'job-{name}', daemon=True)
+        thread.start()
+    app.logger.info(f"Started background jobs: {', '.join(background_jobs) or 'none'}")
+
+@app.cli.command('run-background-jobs')
+def run_background_jobs_command():
+    """Run every registered job (email outbox, expiries, reminders) until stopped
+
+    This is the Procfile worker process; web processes keep ENABLE_BACKGROUND_JOBS off.
+    """
+    try:
+        require_shared_event_broker('background jobs run in their own worker process')
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        # gunicorn empties that directory on start, and /metrics would mix these samples into the web's
+        raise click.ClickException(
+            'PROMETHEUS_MULTIPROC_DIR belongs to the gunicorn web workers; unset it for the background '
+            'worker, which serves its own metrics on WORKER_METRICS_PORT'
+        )
+    if app.config['WORKER_METRICS_PORT']:
+        start_http_server(app.config['WORKER_METRICS_PORT'], addr=app.config['WORKER_METRICS_ADDR'])
+        app.logger.info(f"Serving worker metrics on {app.config['WORKER_METRICS_ADDR']}:{app.config['WORKER_METRICS_PORT']}")
+    start_background_jobs()
+    while True:
+        time.sleep(60)
+
+# ================== EVENT STREAMS ==================
+
+class EventBroker:
+    """In-process publish/subscribe hub feeding the Server-Sent Events endpoints"""
+    
+    def __init__(self, max_queue_size=200):
+        self.max_queue_size = max_queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+    
+    def subscribe(self, channel):
+        self.start()
+        subscriber = queue.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, channel, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[channel]
+    
+    def reset(self, channel):
+        """Close every stream on channel so clients reconnect and receive a fresh snapshot"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            self._close(subscriber)
+    
+    def start(self):
+        """Hook for brokers that need a background listener"""
+    
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscribers.get(channel, ()))
+    
+    def publish(self, channel, event_type, data):
+        self.deliver(channel, event_type, data)
+    
+    def deliver(self, channel, event_type, data):
+        """Hand an event to this process's subscribers"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event_type, data))
+            except queue.Full:
+                # Slow consumer: close the stream so the client reconnects and resyncs
+                self._close(subscriber)
+    
+    def _close(self, subscriber):
+        while True:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                break
+        subscriber.put_nowait((None, None))
+
+class PostgresEventBroker(EventBroker):
+    """EventBroker that fans events out to every worker process via PostgreSQL LISTEN/NOTIFY
+    
+    publish() sends a pg_notify; each process runs one listener thread on a dedicated
+    connection and delivers received events to its local subscribers. Payloads are
+    limited to ~8KB by PostgreSQL, so events must stay small deltas.
+    """
+    
+    NOTIFY_CHANNEL = 'app_events'
+    
+    def __init__(self, max_queue_size=200):
+        super().__init__(max_queue_size)
+        self._dsn = None
+        self._listener_started = False
+    
+    def start(self):
+        if self._listener_started:
+            return
+        with self._lock:
+            if self._listener_started:
+                return
+            self._dsn = db.engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+            self._listener_started = True
+        threading.Thread(target=self._listen, name='event-broker-listener', daemon=True).start()
+    
+    def publish(self, channel, event_type, data):
+        self.start()
+        payload = json.dumps({'channel': channel, 'event': event_type, 'data': data}, default=str)
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(db.text('SELECT pg_notify(:channel, :payload)'),
+                                   {'channel': self.NOTIFY_CHANNEL, 'payload': payload})
+        except Exception as e:
+            # Keep this worker's clients current even if the fan-out fails
+            app.logger.error(f"Event broker notify failed: {e}")
+            self.deliver(channel, event_type, data)
+    
+    def reset(self, channel):
+        """Close the streams on channel in every process (e.g. after a bulk import in the worker)"""
+        self.start()
+        payload = json.dumps({'channel': channel, 'reset': True})
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(db.text('SELECT pg_notify(:channel, :payload)'),
+                                   {'channel': self.NOTIFY_CHANNEL, 'payload': payload})
+        except Exception as e:
+            app.logger.error(f"Event broker notify failed: {e}")
+            super().reset(channel)
+    
+    def _listen(self):
+        import psycopg2
+        import psycopg2.extensions
         
-        flash('Access denied. This feature is only available to trucking companies and staff members.', 'error')
-        return redirect(url_for('dashboard'))
+        while True:
+            connection = None
+            try:
+                connection = psycopg2.connect(self._dsn)
+                connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                connection.cursor().execute(f'LISTEN {self.NOTIFY_CHANNEL}')
+                while True:
+                    if select.select([connection], [], [], 30) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        message = json.loads(connection.notifies.pop(0).payload)
+                        if message.get('reset'):
+                            super().reset(message['channel'])
+                        else:
+                            self.deliver(message['channel'], message['event'], message['data'])
+            except Exception as e:
+                app.logger.error(f"Event broker listener error: {e}")
+                time.sleep(5)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+event_broker = PostgresEventBroker() if app.config['EVENT_BROKER_BACKEND'] == 'postgres' else EventBroker()
+
+def run_after_commit(callback):
+    """Call callback once the current session transaction commits; dropped if it rolls back
+    
+    Lets helpers that only flush (notifications, location changes) publish events without
+    deciding when their caller's transaction ends.
+    """
+    db.session.info.setdefault('after_commit_callbacks', []).append(callback)
+
+@event.listens_for(db.session, 'after_commit')
+def run_after_commit_callbacks(session):
+    for callback in session.info.pop('after_commit_callbacks', []):
+        try:
+            callback()
+        except Exception as e:
+            app.logger.error(f"After-commit callback failed: {e}")
+
+@event.listens_for(db.session, 'after_transaction_end')
+def drop_after_commit_callbacks(session, transaction):
+    # Only the outermost transaction: a rolled back savepoint leaves the outer work pending
+    if transaction.parent is None:
+        session.info.pop('after_commit_callbacks', None)
+
+def require_shared_event_broker(reason):
+    """Refuse to start a second process on the in-process broker: its events would never reach the other's streams"""
+    if not isinstance(event_broker, PostgresEventBroker):
+        raise RuntimeError(
+            f"EVENT_BROKER_BACKEND=postgres is required when {reason}; "
+            f"the '{app.config['EVENT_BROKER_BACKEND']}' broker only reaches streams in its own process"
+        )
+
+# gunicorn.conf.py exports the web worker count before forking the workers
+if int(os.environ.get('WEB_PROCESS_COUNT', 1)) > 1:
+    require_shared_event_broker(f"gunicorn runs {os.environ['WEB_PROCESS_COUNT']} web workers")
+
+def format_sse(event_type, data):
+    """Format a single Server-Sent Events message"""
+    return f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+# Open streams in this process, bounded by EVENT_STREAM_MAX_CONNECTIONS
+event_stream_slots = threading.BoundedSemaphore(app.config['EVENT_STREAM_MAX_CONNECTIONS'])
+
+def event_stream_response(channel, initial_events=(), heartbeat_seconds=15):
+    """Stream events published on channel, preceded by initial_events, as text/event-stream
     
-    decorated_function.__name__ = f.__name__
-    return decorated_function
+    The stream ends after EVENT_STREAM_MAX_SECONDS; EventSource reconnects on its own and
+    receives a fresh snapshot. When every slot is taken a 503 is returned instead, and the
+    page falls back to polling.
+    """
+    if not event_stream_slots.acquire(blocking=False):
+        return jsonify({'success': False, 'error': 'Too many live connections, use polling'}), 503
+    
+    # Subscribe before the caller's snapshot is sent so no delta is lost in between
+    subscriber = event_broker.subscribe(channel)
+    released = []
+    
+    def release():
+        # Runs when the server closes the response, whether or not the generator ever started
+        if not released:
+            released.append(True)
+            event_broker.unsubscribe(channel, subscriber)
+            event_stream_slots.release()
+    
+    deadline = time.monotonic() + app.config['EVENT_STREAM_MAX_SECONDS']
+    
+    def generate():
+        try:
+            # Reconnect quickly after the server ends the stream
+            yield 'retry: 1000\n\n'
+            for event_type, data in initial_events:
+                yield format_sse(event_type, data)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event_type, data = subscriber.get(timeout=min(heartbeat_seconds, remaining))
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if event_type is None:
+                    break
+                yield format_sse(event_type, data)
+        finally:
+            release()
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(release)
+    return response
 
-def load_planning_access_required(f):
-    """Allow access to load planning for trucking companies, pilots, and admin staff"""
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
-        
-        # Allow trucking companies, vendors (pilots), OR admin staff
-        if user and (((user.user_type == 'trucking_company' and user.is_approved) or 
-                     (user.user_type == 'vendor' and user.is_approved)) or 
-                    (user.is_admin and user.admin_role in ['dispatcher', 'admin', 'super_admin'])):
-            return f(*args, **kwargs)
-        
-        if user and user.user_type == 'trucking_company' and not user.is_approved:
-            flash('Your account is pending approval. Please wait for admin approval to access this feature.', 'warning')
-            return redirect(url_for('dashboard'))
-        
-        if user and user.user_type == 'vendor' and not user.is_approved:
+# ================== KPI ROLLUPS ==================
+# Orders by status, leads by status/admin and quote revenue by region are kept as daily
+# rollup rows, next to per-admin lead load and per-user unread notification counters.
+# Every ORM flush that inserts, deletes or changes a tracked column applies
+# the matching +/- deltas in the same transaction. Bulk Query.update()/delete() calls
+# bypass the ORM and must be followed by rebuild_rollups().
+
+def _order_rollup_row(values):
+    key = {'day': values['created_at'].date(), 'status': values['status'] or ''}
+    return key, {'order_count': 1}
+
+def _lead_rollup_row(values):
+    key = {
+        'day': values['created_at'].date(),
+        'status': values['status'] or '',
+        'assigned_admin_id': values['assigned_admin_id'] or 0
+    }
+    return key, {'lead_count': 1, 'conversion_value': values['conversion_value'] or 0.0}
+
+def _quote_rollup_row(values):
+    key = {'day': values['created_at'].date(), 'region': values['region'] or ''}
+    return key, {'quote_count': 1, 'revenue': values['total_cost'] or 0.0}
+
+OPEN_LEAD_STATUSES = ('assigned', 'in_progress')
+
+def _admin_lead_load_row(values):
+    is_open = bool(values['assigned_admin_id']) and values['status'] in OPEN_LEAD_STATUSES
+    key = {'admin_id': values['assigned_admin_id'] or 0}
+    return key, {
+        'open_leads': 1 if is_open else 0,
+        'follow_ups': 1 if is_open and values['next_follow_up_date'] else 0
+    }
+
+def _unread_notification_row(values):
+    return {'user_id': values['user_id']}, {'unread_count': 0 if values['is_read'] else 1}
+
+# (model, rollup model, tracked attributes, row builder)
+ROLLUPS = [
+    (PilotCarOrder, DailyOrderRollup, ('created_at', 'status'), _order_rollup_row),
+    (Lead, DailyLeadRollup, ('created_at', 'status', 'assigned_admin_id', 'conversion_value'), _lead_rollup_row),
+    (Lead, AdminLeadLoad, ('status', 'assigned_admin_id', 'next_follow_up_date'), _admin_lead_load_row),
+    (Quote, DailyQuoteRollup, ('created_at', 'region', 'total_cost'), _quote_rollup_row),
+    (Notification, NotificationUnreadCount, ('user_id', 'is_read'), _unread_notification_row)
+]
+ROLLUP_MODELS = {model for model, _, _, _ in ROLLUPS}
+
+# Bump when a rollup is added or its definition changes: the next upgrade-db rebuilds them once
+ROLLUPS_VERSION = 1
+
+def _track_previous_value(target, value, oldvalue, initiator):
+    return value
+
+# active_history loads the previous value on set, so the old rollup key is always known
+for _model, _attribute in {(model, attribute) for model, _, attributes, _ in ROLLUPS for attribute in attributes}:
+    event.listen(getattr(_model, _attribute), 'set', _track_previous_value, active_history=True, retval=True)
+
+def _rollup_values(obj, attributes, previous=False):
+    state = db.inspect(obj)
+    values = {}
+    for attribute in attributes:
+        history = state.attrs[attribute].history
+        if previous and history.deleted:
+            values[attribute] = history.deleted[0]
+        else:
+            values[attribute] = getattr(obj, attribute)
+    if values.get('created_at') is None:
+        values['created_at'] = datetime.utcnow()
+    return values
+
+def _rollup_changed(obj, attributes):
+    state = db.inspect(obj)
+    return any(state.attrs[attribute].history.has_changes() for attribute in attributes)
+
+def _add_rollup_delta(deltas, rollup_model, row, sign):
+    key, measures = row
+    bucket = deltas.setdefault((rollup_model, tuple(sorted(key.items()))), {})
+    for measure, value in measures.items():
+        bucket[measure] = bucket.get(measure, 0) + sign * value
+
+def apply_rollup_delta(connection, rollup_model, key, measures):
+    """Atomically add measures to the rollup row identified by key (upsert)"""
+    apply_rollup_deltas(connection, rollup_model, [(key, measures)])
+
+def apply_rollup_deltas(connection, rollup_model, deltas):
+    """Upsert many (key, measures) deltas into one rollup table, as a single executemany where supported"""
+    if not deltas:
+        return
+    table = rollup_model.__table__
+    dialect = connection.dialect.name
+    key_columns = list(deltas[0][0])
+    measure_columns = list(deltas[0][1])
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={measure: table.c[measure] + stmt.excluded[measure] for measure in measure_columns}
+        )
+        connection.execute(stmt, [{**key, **measures} for key, measures in deltas])
+        return
+    
+    # Generic fallback for other backends
+    for key, measures in deltas:
+        where = [table.c[column] == value for column, value in key.items()]
+        result = connection.execute(
+            table.update().where(*where).values({measure: table.c[measure] + value for measure, value in measures.items()})
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**key, **measures))
+
+@event.listens_for(db.session, 'after_flush')
+def maintain_rollups(session, flush_context):
+    deltas = {}
+    for model, rollup_model, attributes, row_builder in ROLLUPS:
+        for obj in session.new:
+            if type(obj) is model:
+                _add_rollup_delta(deltas, rollup_model, row_builder(_rollup_values(obj, attributes)), 1)
+        for obj in session.deleted:
+            if type(obj) is model:
+                _add_rollup_delta(deltas, rollup_model, row_builder(_rollup_values(obj, attributes, previous=True)), -1)
+        for obj in session.dirty:
+            if type(obj) is model and obj not in session.deleted and _rollup_changed(obj, attributes):
+                _add_rollup_delta(deltas, rollup_model, row_builder(_rollup_values(obj, attributes, previous=True)), -1)
+                _add_rollup_delta(deltas, rollup_model, row_builder(_rollup_values(obj, attributes)), 1)
+    
+    if deltas:
+        deltas_by_rollup = {}
+        for (rollup_model, key), measures in deltas.items():
+            if any(measures.values()):
+                deltas_by_rollup.setdefault(rollup_model, []).append((dict(key), measures))
+        connection = session.connection()
+        for rollup_model, rollup_deltas in deltas_by_rollup.items():
+            apply_rollup_deltas(connection, rollup_model, rollup_deltas)
+
+def rebuild_rollups():
+    """Recompute every rollup table from the fact tables"""
+    day = lambda column: db.func.date(column)
+    db.session.execute(db.delete(DailyOrderRollup))
+    db.session.execute(db.delete(DailyLeadRollup))
+    db.session.execute(db.delete(DailyQuoteRollup))
+    db.session.execute(db.delete(AdminLeadLoad))
+    db.session.execute(db.delete(NotificationUnreadCount))
+    
+    db.session.execute(db.insert(DailyOrderRollup).from_select(
+        ['day', 'status', 'order_count'],
+        db.select(
+            day(PilotCarOrder.created_at), db.func.coalesce(PilotCarOrder.status, ''), db.func.count(PilotCarOrder.id)
+        ).group_by(day(PilotCarOrder.created_at), db.func.coalesce(PilotCarOrder.status, ''))
+    ))
+    db.session.execute(db.insert(DailyLeadRollup).from_select(
+        ['day', 'status', 'assigned_admin_id', 'lead_count', 'conversion_value'],
+        db.select(
+            day(Lead.created_at), db.func.coalesce(Lead.status, ''), db.func.coalesce(Lead.assigned_admin_id, 0),
+            db.func.count(Lead.id), db.func.coalesce(db.func.sum(Lead.conversion_value), 0.0)
+        ).group_by(day(Lead.created_at), db.func.coalesce(Lead.status, ''), db.func.coalesce(Lead.assigned_admin_id, 0))
+    ))
+    db.session.execute(db.insert(DailyQuoteRollup).from_select(
+        ['day', 'region', 'quote_count', 'revenue'],
+        db.select(
+            day(Quote.created_at), db.func.coalesce(Quote.region, ''),
+            db.func.count(Quote.id), db.func.coalesce(db.func.sum(Quote.total_cost), 0.0)
+        ).group_by(day(Quote.created_at), db.func.coalesce(Quote.region, ''))
+    ))
+    db.session.execute(db.insert(AdminLeadLoad).from_select(
+        ['admin_id', 'open_leads', 'follow_ups'],
+        db.select(
+            Lead.assigned_admin_id, db.func.count(Lead.id),
+            db.func.count(Lead.next_follow_up_date)
+        ).where(
+            Lead.assigned_admin_id.isnot(None), Lead.status.in_(OPEN_LEAD_STATUSES)
+        ).group_by(Lead.assigned_admin_id)
+    ))
+    db.session.execute(db.insert(NotificationUnreadCount).from_select(
+        ['user_id', 'unread_count'],
+        db.select(Notification.user_id, db.func.count(Notification.id))
+        .where(db.or_(Notification.is_read == False, Notification.is_read.is_(None)))
+        .group_by(Notification.user_id)
+    ))
+    db.session.commit()
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the KPI rollup tables from scratch"""
+    rebuild_rollups()
+    print("KPI rollups rebuilt")
+
+def get_order_status_counts():
+    """Current order counts per status from the rollup"""
+    return dict(db.session.query(
+        DailyOrderRollup.status, db.func.sum(DailyOrderRollup.order_count)
+    ).group_by(DailyOrderRollup.status).having(db.func.sum(DailyOrderRollup.order_count) != 0).all())
+
+def get_lead_kpis(assigned_admin_id=None):
+    """Lead totals, conversions and converted value from the rollup"""
+    query = db.session.query(
+        DailyLeadRollup.status,
+        db.func.sum(DailyLeadRollup.lead_count),
+        db.func.sum(DailyLeadRollup.conversion_value)
+    )
+    if assigned_admin_id is not None:
+        query = query.filter(DailyLeadRollup.assigned_admin_id == assigned_admin_id)
+    by_status = {status: (count or 0, value or 0.0) for status, count, value in query.group_by(DailyLeadRollup.status).having(db.func.sum(DailyLeadRollup.lead_count) != 0).all()}
+    
+    total_leads = sum(count for count, _ in by_status.values())
+    conversions, total_value = by_status.get('converted', (0, 0.0))
+    return {
+        'by_status': {status: count for status, (count, _) in by_status.items()},
+        'total_leads': total_leads,
+        'conversions': conversions,
+        'total_value': total_value,
+        'conversion_rate': (conversions / total_leads * 100) if total_leads > 0 else 0
+    }
+
+def get_quote_kpis(since=None):
+    """Quote count and revenue (optionally since a date) from the rollup"""
+    query = db.session.query(
+        db.func.coalesce(db.func.sum(DailyQuoteRollup.quote_count), 0),
+        db.func.coalesce(db.func.sum(DailyQuoteRollup.revenue), 0.0)
+    )
+    if since is not None:
+        query = query.filter(DailyQuoteRollup.day >= since)
+    quote_count, revenue = query.one()
+    return {'quote_count': quote_count, 'revenue': revenue}
+
+# ================== LEAD ROUTING ==================
+# New leads go to the eligible admin with the lightest workload, read from the
+# AdminLeadLoad counters that the rollup hook keeps current on assign/convert/lose.
+
+def pick_lead_owners(count=1):
+    """Return admin ids for count new leads, spreading them by open-lead and follow-up load"""
+    follow_up_weight = app.config['LEAD_ROUTING_FOLLOW_UP_WEIGHT']
+    candidates = db.session.query(
+        User.id,
+        db.func.coalesce(AdminLeadLoad.open_leads, 0),
+        db.func.coalesce(AdminLeadLoad.follow_ups, 0)
+    ).outerjoin(AdminLeadLoad, AdminLeadLoad.admin_id == User.id).filter(
+        User.is_admin == True,
+        db.or_(User.is_suspended == False, User.is_suspended.is_(None)),
+        User.admin_role.in_(app.config['LEAD_ROUTING_ROLES'])
+    ).all()
+    if not candidates:
+        return []
+    
+    heap = [(open_leads + follow_ups * follow_up_weight, admin_id) for admin_id, open_leads, follow_ups in candidates]
+    heapq.heapify(heap)
+    owners = []
+    for _ in range(count):
+        load, admin_id = heapq.heappop(heap)
+        owners.append(admin_id)
+        heapq.heappush(heap, (load + 1, admin_id))
+    return owners
+
+def assign_leads(leads, admin_ids):
+    """Assign each lead to the matching admin id (caller commits)"""
+    now = datetime.utcnow()
+    for lead, admin_id in zip(leads, admin_ids):
+        lead.assigned_admin_id = admin_id
+        lead.status = 'assigned'
+        lead.updated_at = now
+
+def notify_lead_assignments(leads):
+    """Tell each admin about the leads they were just given (caller commits)"""
+    leads_by_admin = {}
+    for lead in leads:
+        leads_by_admin.setdefault(lead.assigned_admin_id, []).append(lead)
+    
+    notifications = []
+    for admin_id, admin_leads in leads_by_admin.items():
+        if len(admin_leads) == 1:
+            lead = admin_leads[0]
+            notifications.append({
+                'user_id': admin_id,
+                'type': 'lead_assigned',
+                'title': f'New Lead Assigned: {lead.company.company_name}',
+                'message': f'You have been assigned a new lead from {lead.company.company_name}',
+                'action_url': f'/admin/crm/lead/{lead.id}'
+            })
+        else:
+            notifications.append({
+                'user_id': admin_id,
+                'type': 'lead_assigned',
+                'title': f'{len(admin_leads)} Leads Assigned',
+                'message': f'You have been assigned {len(admin_leads)} new leads',
+                'action_url': '/admin/crm/leads?status=assigned'
+            })
+    create_notifications_bulk(notifications)
+
+# ================== PAGINATION HELPERS ==================
+
+KEYSET_MAX_PAGE_SIZE = 100
+
+def encode_keyset_cursor(created_at, row_id):
+    """Opaque cursor for the (created_at, id) position of the last row on a page"""
+    return f"{created_at.isoformat()}_{row_id}"
+
+def decode_keyset_cursor(cursor):
+    """Inverse of encode_keyset_cursor; raises ValueError on malformed cursors"""
+    created_at, row_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(created_at), int(row_id)
+
+def keyset_paginate(query, model, cursor=None, limit=20, order_column=None):
+    """Fetch one page of query, newest first, continuing after cursor
+    
+    Uses a (order_column, id) seek predicate instead of OFFSET so every page costs the
+    same regardless of how deep it is. Returns (rows, next_cursor); next_cursor is None
+    on the last page.
+    """
+    order_column = order_column if order_column is not None else model.created_at
+    limit = max(1, min(limit or 20, KEYSET_MAX_PAGE_SIZE))
+    
+    if cursor:
+        cursor_created_at, cursor_id = decode_keyset_cursor(cursor)
+        query = query.filter(db.or_(
+            order_column < cursor_created_at,
+            db.and_(order_column == cursor_created_at, model.id < cursor_id)
+        ))
+    
+    rows = query.order_by(order_column.desc(), model.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        last_model = last[0] if hasattr(last, '_fields') else last  # Row from a multi-entity query
+        next_cursor = encode_keyset_cursor(getattr(last_model, order_column.key), last_model.id)
+    return rows, next_cursor
+
+# Request user and cached session claims
+def get_current_user():
+    """The logged-in User, loaded once per request and shared by the access decorators and handlers"""
+    user_id = session.get('user_id')
+    cached = g.get('current_user')
+    if cached is None or cached[0] != user_id:
+        user = db.session.get(User, user_id) if user_id else None
+        if user and session.get('claims_version') != user.claims_version:
+            store_session_claims(user)
+        g.current_user = cached = (user_id, user)
+    return cached[1]
+
+def store_session_claims(user):
+    """Cache the user's role and approval claims in the session, stamped with claims_version"""
+    session['company_name'] = user.company_name
+    session['is_admin'] = user.is_admin
+    session['user_type'] = user.user_type
+    session['is_approved'] = user.is_approved
+    session['admin_role'] = user.admin_role  # Store admin role for navigation template
+    session['is_super_admin'] = user.is_admin and user.admin_role == 'super_admin'  # Store super admin flag for templates
+    session['permissions'] = compile_permissions(user)
+    session['claims_version'] = user.claims_version
+
+def bump_claims_version(user):
+    """Mark sessions holding this user's claims as stale (approve, suspend, role change)"""
+    user.claims_version = (user.claims_version or 0) + 1
+
+# Permissions: each user's capabilities are compiled into a bitset and cached in the session
+PERM_LOGGED_IN = 1 << 0          # any active account
+PERM_ANY_ADMIN = 1 << 1          # any staff account (is_admin)
+PERM_STAFF = 1 << 2              # dispatcher, admin, super_admin
+PERM_ADMIN_PANEL = 1 << 3        # admin, super_admin (excludes dispatchers)
+PERM_MANAGE_ADMINS = 1 << 4      # super_admin
+PERM_TRUCKING_PORTAL = 1 << 5    # trucking company features
+PERM_VENDOR_PORTAL = 1 << 6      # pilot car vendor features
+PERM_DISPATCH = 1 << 7           # approved trucking companies and staff
+PERM_LOAD_PLANNING = 1 << 8      # approved trucking companies, approved vendors and staff
+PERM_TRUCKING_FEATURES = 1 << 9  # approved trucking companies, admin and super_admin
+
+ROLE_PERMISSIONS = {
+    'super_admin': PERM_ANY_ADMIN | PERM_STAFF | PERM_ADMIN_PANEL | PERM_MANAGE_ADMINS | PERM_DISPATCH | PERM_LOAD_PLANNING | PERM_TRUCKING_FEATURES,
+    'admin': PERM_ANY_ADMIN | PERM_STAFF | PERM_ADMIN_PANEL | PERM_DISPATCH | PERM_LOAD_PLANNING | PERM_TRUCKING_FEATURES,
+    'dispatcher': PERM_ANY_ADMIN | PERM_STAFF | PERM_DISPATCH | PERM_LOAD_PLANNING,
+    'staff': PERM_ANY_ADMIN,  # is_admin without a known admin_role
+    'trucking_company': PERM_TRUCKING_PORTAL | PERM_DISPATCH | PERM_LOAD_PLANNING | PERM_TRUCKING_FEATURES,
+    'vendor': PERM_VENDOR_PORTAL | PERM_LOAD_PLANNING,
+}
+
+# What a user_type may use while the account is still pending approval
+PENDING_ROLE_PERMISSIONS = {
+    'trucking_company': 0,
+    'vendor': PERM_VENDOR_PORTAL,
+}
+
+# (message, flash category) shown for the first permission a user is missing
+PERMISSION_DENIED_MESSAGES = {
+    PERM_ANY_ADMIN: ('Admin access required', 'message'),
+    PERM_STAFF: ('Staff access required', 'message'),
+    PERM_ADMIN_PANEL: ('Admin access required', 'message'),
+    PERM_MANAGE_ADMINS: ('Access denied. Super Admin access required.', 'error'),
+    PERM_TRUCKING_PORTAL: ('This feature is only available to trucking companies.', 'message'),
+    PERM_VENDOR_PORTAL: ('This feature is only available to vendors.', 'message'),
+    PERM_DISPATCH: ('Access denied. This feature is only available to trucking companies and staff members.', 'error'),
+    PERM_LOAD_PLANNING: ('Access denied. This feature is available to trucking companies, pilot car vendors, and staff members.', 'error'),
+    PERM_TRUCKING_FEATURES: ('Access denied. This feature is only available to trucking companies and senior staff members.', 'error'),
+}
+
+def compile_permissions(user, assume_approved=False):
+    """Compile a user's roles and approval state into a permission bitset"""
+    permissions = PERM_LOGGED_IN
+    if user.is_admin:
+        permissions |= ROLE_PERMISSIONS.get(user.admin_role, ROLE_PERMISSIONS['staff'])
+        if user.user_type == 'trucking_company':
+            permissions |= PERM_TRUCKING_PORTAL  # Staff accounts are created as trucking companies
+    if user.is_approved or assume_approved:
+        permissions |= ROLE_PERMISSIONS.get(user.user_type, 0)
+    else:
+        permissions |= PENDING_ROLE_PERMISSIONS.get(user.user_type, 0)
+    return permissions
+
+def has_permission(required):
+    """True if the logged-in, non-suspended user holds every permission bit in required"""
+    user = get_current_user()
+    if not user or user.is_suspended:
+        return False
+    return session.get('permissions', 0) & required == required
+
+def permission_denied(user, required):
+    """Redirect with the message for the first missing permission"""
+    if not user.is_approved and compile_permissions(user, assume_approved=True) & required == required:
+        if user.user_type == 'vendor':
             flash('Your pilot account is pending approval. Please wait for admin approval to access this feature.', 'warning')
             return redirect(url_for('vendor_dashboard'))
-        
-        flash('Access denied. This feature is available to trucking companies, pilot car vendors, and staff members.', 'error')
-        return redirect(url_for('dashboard'))
-    
-    decorated_function.__name__ = f.__name__
-    return decorated_function
-
-def trucking_company_or_admin_required(f):
-    """Allow access to trucking companies, admin, and super admin roles (excludes dispatchers)"""
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
-        if not user:
-            session.clear()
-            return redirect(url_for('login'))
-            
-        if user.is_suspended:
-            session.clear()
-            flash('Your account has been suspended. Please contact support.')
-            return redirect(url_for('login'))
-        
-        # Allow approved trucking companies OR admin/super_admin staff (excludes dispatchers)
-        if user and ((user.user_type == 'trucking_company' and user.is_approved) or 
-                    (user.is_admin and user.admin_role in ['admin', 'super_admin'])):
-            return f(*args, **kwargs)
-        
-        if user and user.user_type == 'trucking_company' and not user.is_approved:
-            flash('Your account is pending approval. Please wait for admin approval to access this feature.', 'warning')
-            return redirect(url_for('dashboard'))
-        
-        if user and user.is_admin and user.admin_role == 'dispatcher':
-            flash('Access denied. This feature is not available to dispatchers.', 'error')
-            return redirect(url_for('dashboard'))
-        
-        flash('Access denied. This feature is only available to trucking companies and senior staff members.', 'error')
+        flash('Your account is pending approval. Please wait for admin approval to access this feature.', 'warning')
         return redirect(url_for('dashboard'))
     
-    decorated_function.__name__ = f.__name__
-    return decorated_function
-
-def super_admin_required(f):
-    """Allow access only to super admin role"""
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
-        if not user:
-            session.clear()
-            return redirect(url_for('login'))
-            
-        if user.is_suspended:
-            session.clear()
-            flash('Your account has been suspended. Please contact support.')
-            return redirect(url_for('login'))
-        
-        # Only allow super admins
-        if user and user.is_admin and user.admin_role == 'super_admin':
+    missing = required & ~session.get('permissions', 0)
+    message, category = PERMISSION_DENIED_MESSAGES.get(missing & -missing, ('Access denied.', 'error'))
+    if user.is_admin and missing & (PERM_ADMIN_PANEL | PERM_STAFF):
+        message, category = 'Access denied. You do not have permission to access this feature.', 'error'
+    flash(message, category)
+    return redirect(url_for('dashboard'))
+
+def permission_required(required):
+    """Decorator allowing the view only to users holding every bit of the required mask"""
+    def decorator(f):
+        def decorated_function(*args, **kwargs):
+            if 'user_id' not in session:
+                return redirect(url_for('login'))
+            
+            user = get_current_user()
+            if not user:
+                session.clear()
+                return redirect(url_for('login'))
+            
+            if user.is_suspended:
+                session.clear()
+                flash('Your account has been suspended. Please contact support.')
+                return redirect(url_for('login'))
+            
+            if session.get('permissions', 0) & required != required:
+                return permission_denied(user, required)
+            
             return f(*args, **kwargs)
-        
-        flash('Access denied. Super Admin access required.', 'error')
-        return redirect(url_for('dashboard'))
-    
-    decorated_function.__name__ = f.__name__
-    return decorated_function
+        decorated_function.__name__ = f.__name__
+        return decorated_function
+    return decorator
+
+# Named access decorators used throughout the routes
+login_required = permission_required(PERM_LOGGED_IN)
+trucking_company_required = permission_required(PERM_TRUCKING_PORTAL)
+vendor_required = permission_required(PERM_VENDOR_PORTAL)
+admin_required = permission_required(PERM_ANY_ADMIN)
+admin_or_super_admin_required = permission_required(PERM_ADMIN_PANEL)
+dispatcher_or_higher_required = permission_required(PERM_STAFF)
+dispatcher_or_trucking_company_required = permission_required(PERM_DISPATCH)
+load_planning_access_required = permission_required(PERM_LOAD_PLANNING)
+trucking_company_or_admin_required = permission_required(PERM_TRUCKING_FEATURES)
+super_admin_required = permission_required(PERM_MANAGE_ADMINS)
 
 # Routes
 @app.route('/', methods=['GET', 'POST'])
@@ -1410,19 +2844,14 @@ def login():
             return render_template('login.html')
         
         user = User.query.filter_by(email=email).first()
-        if user and check_password_hash(user.password_hash, password):
+        if user and user.password_hash and check_password_hash(user.password_hash, password):
             # Check if user is suspended
             if user.is_suspended:
                 flash('Your account has been suspended. Please contact support.')
                 return render_template('login.html')
             
             session['user_id'] = user.id
-            session['company_name'] = user.company_name
-            session['is_admin'] = user.is_admin
-            session['user_type'] = user.user_type
-            session['is_approved'] = user.is_approved
-            session['admin_role'] = user.admin_role  # Store admin role for navigation template
-            session['is_super_admin'] = user.is_admin and user.admin_role == 'super_admin'  # Store super admin flag for templates
+            store_session_claims(user)
             
             # Create audit log for login
             create_audit_log(
@@ -1520,7 +2949,7 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user:
         # User not found, clear session and redirect to login
         session.clear()
@@ -1689,7 +3118,7 @@ def save_route():
         db.session.commit()
         
         # Create lead for trucking company load planning activity
-        current_user = User.query.get(session['user_id'])
+        current_user = get_current_user()
         if current_user and not current_user.is_admin:
             # Estimate value based on route distance and complexity
             route_results = data.get('route_results', {})
@@ -1770,7 +3199,7 @@ def calculate_quote_route():
             db.session.commit()
             
             # Create lead for trucking company activity
-            current_user = User.query.get(session['user_id'])
+            current_user = get_current_user()
             if current_user and not current_user.is_admin:
                 estimated_value = quote_result.get('total_cost', 0)
                 notes = f"Quote request for {', '.join(data['car_types'])} from {data['pickup_location']} to {data['delivery_location']}"
@@ -1815,14 +3244,14 @@ def my_quotes():
 @login_required
 def view_profile():
     """View user profile"""
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     return render_template('profile/view_profile.html', user=user)
 
 @app.route('/profile/edit')
 @login_required 
 def edit_profile():
     """Edit user profile"""
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     return render_template('profile/edit_profile.html', user=user)
 
 @app.route('/profile/update', methods=['POST'])
@@ -1830,7 +3259,7 @@ def edit_profile():
 def update_profile():
     """Handle profile updates via AJAX"""
     try:
-        user = User.query.get(session['user_id'])
+        user = get_current_user()
         data = request.get_json()
         
         if not data:
@@ -1851,7 +3280,7 @@ def update_profile():
         # Check if email is being changed and if it's already taken
         new_email = data.get('email', '').strip().lower()
         if new_email != user.email.lower():
-            existing_user = User.query.filter(User.email.ilike(new_email), User.id != user.id).first()
+            existing_user = User.query.filter(db.func.lower(User.email) == new_email, User.id != user.id).first()
             if existing_user:
                 return jsonify({'success': False, 'message': 'Email address is already in use by another account'})
             
@@ -1928,7 +3357,7 @@ def update_profile():
 def change_password():
     """Handle password changes via AJAX"""
     try:
-        user = User.query.get(session['user_id'])
+        user = get_current_user()
         data = request.get_json()
         
         if not data:
@@ -1981,40 +3410,95 @@ def change_password():
 @app.route('/admin')
 @admin_or_super_admin_required
 def admin_dashboard():
-    """Main admin dashboard"""
-    users = User.query.all()
-    total_routes = SavedRoute.query.count()
-    total_quotes = Quote.query.count()
+    """Main admin dashboard - aggregates only; recent lists load through the JSON endpoints"""
+    # User counts in a single grouped query
+    user_stats = {'total': 0, 'customers': 0, 'admins': 0, 'trucking_companies': 0, 'vendors': 0}
+    user_counts = db.session.query(User.is_admin, User.user_type, db.func.count(User.id))\
+        .group_by(User.is_admin, User.user_type).all()
+    for is_admin, user_type, count in user_counts:
+        user_stats['total'] += count
+        if is_admin:
+            user_stats['admins'] += count
+        else:
+            user_stats['customers'] += count
+            if user_type == 'trucking_company':
+                user_stats['trucking_companies'] += count
+            elif user_type == 'vendor':
+                user_stats['vendors'] += count
     
-    # Calculate total revenue from quotes
-    total_revenue = db.session.query(db.func.sum(Quote.total_cost)).scalar() or 0
+    total_routes = db.session.query(db.func.count(SavedRoute.id)).scalar()
+    quote_kpis = get_quote_kpis()
+    total_quotes, total_revenue = quote_kpis['quote_count'], quote_kpis['revenue']
     
     # Get pilot location statistics
-    total_vendor_locations = VendorLocation.query.count()
-    active_vendor_locations = VendorLocation.query.filter(
-        VendorLocation.expires_at > datetime.utcnow()
-    ).count()
-    
-    # Fetch all saved routes for admin viewing
-    all_routes = db.session.query(SavedRoute, User)\
-        .join(User, SavedRoute.user_id == User.id)\
-        .order_by(SavedRoute.created_at.desc())\
-        .all()
-    
-    # Fetch all quotes for admin viewing
-    all_quotes = db.session.query(Quote, User)\
-        .join(User, Quote.user_id == User.id)\
-        .order_by(Quote.created_at.desc())\
-        .all()
+    total_vendor_locations, active_vendor_locations = db.session.query(
+        db.func.count(VendorLocation.id),
+        db.func.coalesce(db.func.sum(db.case((VendorLocation.expires_at > datetime.utcnow(), 1), else_=0)), 0)
+    ).one()
     
     # Get current time
     current_time = datetime.now().strftime('%m/%d/%Y %I:%M %p')
     
-    return render_template('admin.html', users=users, total_routes=total_routes, 
+    return render_template('admin.html', user_stats=user_stats, total_routes=total_routes, 
                          total_quotes=total_quotes, total_revenue=total_revenue,
                          total_vendor_locations=total_vendor_locations, 
                          active_vendor_locations=active_vendor_locations,
-                         all_routes=all_routes, all_quotes=all_quotes, current_time=current_time)
+                         current_time=current_time)
+
+@app.route('/api/admin/recent-routes')
+@admin_or_super_admin_required
+def api_admin_recent_routes():
+    """Saved routes newest first, keyset-paginated on (created_at, id)"""
+    try:
+        query = db.session.query(SavedRoute, User.company_name)\
+            .join(User, SavedRoute.user_id == User.id)
+        rows, next_cursor = keyset_paginate(
+            query, SavedRoute, request.args.get('cursor'), request.args.get('limit', 10, type=int)
+        )
+        return jsonify({
+            'success': True,
+            'routes': [{
+                'id': route.id,
+                'company_name': company_name,
+                'route_name': route.route_name,
+                'origin': route.origin,
+                'destination': route.destination,
+                'road_type': route.road_type,
+                'created_at': route.created_at.isoformat()
+            } for route, company_name in rows],
+            'next_cursor': next_cursor
+        })
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/admin/recent-quotes')
+@admin_or_super_admin_required
+def api_admin_recent_quotes():
+    """Quotes newest first, keyset-paginated on (created_at, id)"""
+    try:
+        query = db.session.query(Quote, User.company_name)\
+            .join(User, Quote.user_id == User.id)
+        rows, next_cursor = keyset_paginate(
+            query, Quote, request.args.get('cursor'), request.args.get('limit', 10, type=int)
+        )
+        return jsonify({
+            'success': True,
+            'quotes': [{
+                'id': quote.id,
+                'company_name': company_name,
+                'pickup_state': quote.pickup_state,
+                'delivery_state': quote.delivery_state,
+                'total_cost': quote.total_cost,
+                'created_at': quote.created_at.isoformat()
+            } for quote, company_name in rows],
+            'next_cursor': next_cursor
+        })
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
 @app.route('/admin/customers')
 @admin_or_super_admin_required
@@ -2041,60 +3525,197 @@ def admin_load_plans():
         .all()
     return render_template('admin_load_plans.html', routes=routes)
 
+def promote_assigned_leads_with_actions():
+    """One-off set-based fix for leads left 'assigned' although they already have actions.
+    
+    New actions move their lead to 'in_progress' in add_lead_action; this only repairs older data.
+    """
+    result = db.session.execute(
+        db.update(Lead)
+        .where(Lead.status == 'assigned', db.exists().where(LeadAction.lead_id == Lead.id))
+        .values(status='in_progress', updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    
+    # Bulk UPDATE bypasses the rollup hook
+    if result.rowcount:
+        rebuild_rollups()
+    return result.rowcount
+
+@app.cli.command('migrate-lead-statuses')
+def migrate_lead_statuses_command():
+    """Move 'assigned' leads that already have actions to 'in_progress'"""
+    updated = promote_assigned_leads_with_actions()
+    print(f"Updated {updated} leads to in_progress")
+
+LEADS_PAGE_SIZE = 50
+LEAD_ACTIVITY_PAGE_SIZE = 10
+
+def ensure_indexes():
+    """Create indexes added after the tables were first created (create_all skips existing tables)
+    
+    On PostgreSQL the CRM company search also gets a pg_trgm GIN index so ILIKE '%term%'
+    no longer scans every user row.
+    """
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if connection.dialect.name in ('postgresql', 'sqlite'):
+                    # IF NOT EXISTS also covers expression indexes, which checkfirst cannot see on SQLite
+                    connection.execute(CreateIndex(index, if_not_exists=True))
+                else:
+                    index.create(connection, checkfirst=True)
+        if connection.dialect.name == 'postgresql':
+            try:
+                # Savepoint: servers without the contrib extensions still get every other index
+                with connection.begin_nested():
+                    connection.execute(db.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+                    connection.execute(db.text(
+                        'CREATE INDEX IF NOT EXISTS ix_user_company_name_trgm ON "user" USING gin (company_name gin_trgm_ops)'
+                    ))
+            except DBAPIError as e:
+                app.logger.warning(f"Skipping the company name trigram index, pg_trgm is unavailable: {e.orig}")
+
+# Columns added to existing tables after they were first created: (model, column name)
+ADDED_COLUMNS = [
+    (User, 'claims_version'),
+    (BackgroundJobRun, 'cursor'),
+    (VendorImportJob, 'csv_data'),
+]
+
+def ensure_columns():
+    """Add columns from ADDED_COLUMNS that an existing database is missing (create_all skips existing tables)"""
+    with db.engine.begin() as connection:
+        inspector = db.inspect(connection)
+        for model, column_name in ADDED_COLUMNS:
+            table = model.__table__
+            if column_name in {column['name'] for column in inspector.get_columns(table.name)}:
+                continue
+            column = table.c[column_name]
+            column_type = column.type.compile(dialect=connection.dialect)
+            preparer = connection.dialect.identifier_preparer
+            default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ''
+            not_null = ' NOT NULL' if not column.nullable and default else ''
+            connection.execute(db.text(
+                f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.quote(column_name)} {column_type}{default}{not_null}"
+            ))
+
+def upgrade_database():
+    """Bring a database up to the current models: new tables, columns and indexes, then rollups
+    
+    Must run before the web workers start serving a new release, because the models already
+    select the added columns (the Procfile release process runs `flask upgrade-db`).
+    """
+    db.create_all()
+    ensure_columns()
+    # Older releases could leave several rows per registered vendor, which the unique index rejects
+    retire_duplicate_vendor_locations()
+    ensure_indexes()
+    
+    # Rollups are only maintained by deltas from here on, so seed them from the fact tables once per version
+    marker = db.session.get(MaintenanceMarker, 'rollups')
+    if marker is None or marker.version != ROLLUPS_VERSION:
+        rebuild_rollups()
+        db.session.merge(MaintenanceMarker(name='rollups', version=ROLLUPS_VERSION, applied_at=datetime.utcnow()))
+        db.session.commit()
+        app.logger.info(f"Rebuilt KPI rollups (version {ROLLUPS_VERSION})")
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Apply schema changes to an existing database (run on every deploy)"""
+    upgrade_database()
+    print("Database upgraded")
+
+@app.cli.command('create-indexes')
+def create_indexes_command():
+    """Create new tables, add new columns and create any missing model indexes on an existing database"""
+    upgrade_database()
+    print("Tables, columns and indexes created")
+
+# Hot queries whose plans must stay on an index: (name, statement builder)
+HOT_QUERY_PLANS = [
+    ('saved routes by user', lambda: db.select(SavedRoute).where(SavedRoute.user_id == 1).order_by(SavedRoute.created_at.desc())),
+    ('quotes by user', lambda: db.select(Quote).where(Quote.user_id == 1).order_by(Quote.created_at.desc())),
+    ('orders by user', lambda: db.select(PilotCarOrder).where(PilotCarOrder.user_id == 1).order_by(PilotCarOrder.created_at.desc())),
+    ('orders by status', lambda: db.select(db.func.count()).select_from(PilotCarOrder).where(PilotCarOrder.status == 'pending')),
+    ('leads by status', lambda: db.select(Lead).where(Lead.status == 'pending')),
+    ('leads by company and status', lambda: db.select(Lead).where(Lead.company_id == 1, Lead.status == 'pending')),
+    ('follow-ups by date', lambda: db.select(LeadAction).where(
+        LeadAction.follow_up_date >= datetime(2025, 1, 1), LeadAction.follow_up_date < datetime(2025, 2, 1))),
+    ('published blog posts', lambda: db.select(BlogPost).where(BlogPost.status == 'published').order_by(BlogPost.published_at.desc()).limit(10)),
+    ('unread notifications', lambda: db.select(Notification).where(Notification.user_id == 1, Notification.is_read == False)),
+    ('email uniqueness check', lambda: db.select(User.id).where(db.func.lower(User.email) == 'user@example.com', User.id != 1)),
+    ('audit events by user', lambda: db.select(AuditEvent).where(AuditEvent.user_id == 1).order_by(AuditEvent.created_at.desc()).limit(20)),
+]
+
+def explain_query(connection, statement):
+    """Return (plan lines, full-scan lines) for a statement on SQLite or PostgreSQL"""
+    sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+    if connection.dialect.name == 'postgresql':
+        # Tiny tables make the planner prefer a seq scan; disable it so one only shows up when no index fits
+        connection.execute(db.text('SET LOCAL enable_seqscan = off'))
+        plan = [row[0] for row in connection.execute(db.text(f'EXPLAIN {sql}'))]
+        return plan, [line for line in plan if 'Seq Scan' in line]
+    plan = [row[-1] for row in connection.execute(db.text(f'EXPLAIN QUERY PLAN {sql}'))]
+    return plan, [line for line in plan if line.startswith('SCAN') and 'USING' not in line]
+
+@app.cli.command('check-query-plans')
+@click.option('--verbose', is_flag=True, help='Print every plan, not just failures')
+def check_query_plans_command(verbose):
+    """EXPLAIN each hot query and exit non-zero if any of them falls back to a full table scan"""
+    failures = []
+    with db.engine.connect() as connection:
+        for name, build_statement in HOT_QUERY_PLANS:
+            with connection.begin():
+                plan, full_scans = explain_query(connection, build_statement())
+            if full_scans:
+                failures.append(name)
+            if full_scans or verbose:
+                print(f"{'FULL SCAN' if full_scans else 'ok'}: {name}")
+                for line in plan:
+                    print(f"    {line}")
+    if failures:
+        raise click.ClickException(f"{len(failures)} hot queries use a full table scan: {', '.join(failures)}")
+    print(f"All {len(HOT_QUERY_PLANS)} hot query plans use indexes")
+
 # CRM Routes for regular admins
 @app.route('/admin/crm')
 @admin_or_super_admin_required
 def admin_crm_dashboard():
     """CRM Dashboard showing lead overview and statistics"""
-    current_user = User.query.get(session['user_id'])
+    current_user = get_current_user()
     
-    # Auto-update status for leads with actions but still marked as 'assigned'
-    assigned_leads_with_actions = Lead.query.filter_by(status='assigned').all()
-    for lead in assigned_leads_with_actions:
-        if len(lead.actions) > 0:
-            lead.status = 'in_progress'
-    db.session.commit()
+    # Get lead lists (company is rendered for every row)
+    pending_leads = Lead.query.options(joinedload(Lead.company)).filter_by(status='pending').all()
+    my_leads = Lead.query.options(joinedload(Lead.company)).filter_by(assigned_admin_id=current_user.id).all()
     
-    # Get all leads
-    all_leads = Lead.query.all()
-    pending_leads = Lead.query.filter_by(status='pending').all()
-    my_leads = Lead.query.filter_by(assigned_admin_id=current_user.id).all()
-    
-    # Calculate performance statistics based on role
+    # Calculate performance statistics based on role (from the KPI rollups)
     if session.get('is_super_admin'):
         # Super Admin sees overall system performance
-        total_leads = len(all_leads)
-        converted_leads = Lead.query.filter_by(status='converted').all()
-        total_value = sum([lead.conversion_value or 0 for lead in converted_leads])
-        conversion_rate = (len(converted_leads) / total_leads * 100) if total_leads > 0 else 0
+        lead_kpis = get_lead_kpis()
         
         # Get recent quotes for revenue calculation (last 30 days)
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        recent_quotes = Quote.query.filter(Quote.created_at >= thirty_days_ago).all()
-        quote_revenue = sum([quote.total_cost for quote in recent_quotes])
+        thirty_days_ago = (datetime.now() - timedelta(days=30)).date()
+        quote_revenue = get_quote_kpis(since=thirty_days_ago)['revenue']
         
         performance = {
-            'total_revenue': quote_revenue + total_value,  # Quotes + converted leads
-            'conversion_rate': conversion_rate,
-            'total_leads': total_leads,
-            'conversions': len(converted_leads),
-            'total_value': total_value
+            'total_revenue': quote_revenue + lead_kpis['total_value'],  # Quotes + converted leads
+            'conversion_rate': lead_kpis['conversion_rate'],
+            'total_leads': lead_kpis['total_leads'],
+            'conversions': lead_kpis['conversions'],
+            'total_value': lead_kpis['total_value']
         }
     else:
         # Regular Admin sees only their own performance
-        my_assigned_leads = Lead.query.filter_by(assigned_admin_id=current_user.id).all()
-        my_converted_leads = [lead for lead in my_assigned_leads if lead.status == 'converted']
-        my_total_value = sum([lead.conversion_value or 0 for lead in my_converted_leads])
-        
-        # Calculate personal conversion rate based on assigned leads only
-        my_conversion_rate = (len(my_converted_leads) / len(my_assigned_leads) * 100) if len(my_assigned_leads) > 0 else 0
+        lead_kpis = get_lead_kpis(assigned_admin_id=current_user.id)
         
         performance = {
-            'total_revenue': my_total_value,  # Only personal converted lead value
-            'conversion_rate': my_conversion_rate,
-            'total_leads': len(my_assigned_leads),
-            'conversions': len(my_converted_leads),
-            'total_value': my_total_value
+            'total_revenue': lead_kpis['total_value'],  # Only personal converted lead value
+            'conversion_rate': lead_kpis['conversion_rate'],
+            'total_leads': lead_kpis['total_leads'],
+            'conversions': lead_kpis['conversions'],
+            'total_value': lead_kpis['total_value']
         }
     
     return render_template('admin/crm_dashboard.html', 
@@ -2107,15 +3728,15 @@ def admin_crm_dashboard():
 @admin_or_super_admin_required
 def admin_crm_leads():
     """All leads management"""
-    current_user = User.query.get(session['user_id'])
+    current_user = get_current_user()
     
     # Get filter parameters
     status_filter = request.args.get('status', 'all')
     admin_filter = request.args.get('admin_id', 'all')
     search = request.args.get('search', '').strip()
     
-    # Build base query
-    query = Lead.query.join(User, Lead.company_id == User.id)
+    # Build base query (company and assigned admin are rendered for every row)
+    query = Lead.query.options(joinedload(Lead.company), joinedload(Lead.assigned_admin))
     
     # Apply status filter
     if status_filter and status_filter != 'all':
@@ -2127,10 +3748,25 @@ def admin_crm_leads():
     
     # Apply company search filter
     if search:
-        query = query.filter(User.company_name.ilike(f'%{search}%'))
+        query = query.filter(Lead.company_id.in_(
+            db.select(User.id).where(User.company_name.ilike(f'%{search}%'))
+        ))
     
-    # Get filtered leads
-    leads = query.order_by(Lead.created_at.desc()).all()
+    # Get one page of filtered leads
+    try:
+        leads, next_cursor = keyset_paginate(query, Lead, request.args.get('cursor'), LEADS_PAGE_SIZE)
+    except ValueError:
+        flash('Invalid page cursor')
+        return redirect(url_for('admin_crm_leads', status=status_filter, admin_id=admin_filter, search=search))
+    
+    # Total matching leads from the rollup (not available for free-text search)
+    total_leads = None
+    if not search:
+        lead_kpis = get_lead_kpis(int(admin_filter) if admin_filter and admin_filter != 'all' else None)
+        if status_filter and status_filter != 'all':
+            total_leads = lead_kpis['by_status'].get(status_filter, 0)
+        else:
+            total_leads = lead_kpis['total_leads']
     
     # Get all admin users for assignment dropdown
     admin_users = User.query.filter(User.is_admin == True).all()
@@ -2138,6 +3774,8 @@ def admin_crm_leads():
     return render_template('admin/crm_leads.html', 
                          current_user=current_user, 
                          leads=leads,
+                         next_cursor=next_cursor,
+                         total_leads=total_leads,
                          admins=admin_users,
                          status_filter=status_filter,
                          admin_filter=admin_filter,
@@ -2147,13 +3785,20 @@ def admin_crm_leads():
 @admin_or_super_admin_required
 def admin_crm_lead_detail(lead_id):
     """Individual lead detail and management"""
-    current_user = User.query.get(session['user_id'])
-    lead = Lead.query.get_or_404(lead_id)
-    
-    # Auto-update status: if lead has actions but status is still 'assigned', change to 'in_progress'
-    if lead.status == 'assigned' and len(lead.actions) > 0:
-        lead.status = 'in_progress'
-        db.session.commit()
+    current_user = get_current_user()
+    lead = Lead.query.options(
+        joinedload(Lead.company),
+        joinedload(Lead.assigned_admin),
+        selectinload(Lead.actions).joinedload(LeadAction.admin)
+    ).filter_by(id=lead_id).first_or_404()
+    
+    # Latest customer activity, one page at a time
+    try:
+        activities, next_activity_cursor = keyset_paginate(
+            lead.activities, LeadActivity, request.args.get('activity_cursor'), LEAD_ACTIVITY_PAGE_SIZE
+        )
+    except ValueError:
+        return redirect(url_for('admin_crm_lead_detail', lead_id=lead.id))
     
     # Get all admin users for assignment dropdown
     admin_users = User.query.filter(User.is_admin == True).all()
@@ -2161,6 +3806,8 @@ def admin_crm_lead_detail(lead_id):
     return render_template('admin/crm_lead_detail.html', 
                          current_user=current_user, 
                          lead=lead,
+                         activities=activities,
+                         next_activity_cursor=next_activity_cursor,
                          admins=admin_users,
                          current_datetime=datetime.now())
 
@@ -2168,7 +3815,7 @@ def admin_crm_lead_detail(lead_id):
 @admin_or_super_admin_required
 def admin_crm_follow_ups():
     """Follow-up management"""
-    current_user = User.query.get(session['user_id'])
+    current_user = get_current_user()
     
     # Get filter parameters
     days_ahead = int(request.args.get('days', 7))  # Default to 7 days
@@ -2178,11 +3825,7 @@ def admin_crm_follow_ups():
     today = datetime.now().date()
     
     # Base query for actions with follow-up dates
-    base_query = LeadAction.query.filter(
-        LeadAction.follow_up_date.isnot(None)
-    ).join(Lead).filter(
-        Lead.status.in_(['assigned', 'in_progress'])
-    )
+    base_query = follow_up_actions_query()
     
     # Filter by admin if specified (super admin only)
     if admin_filter and session.get('is_super_admin'):
@@ -2194,7 +3837,7 @@ def admin_crm_follow_ups():
     # Get overdue follow-ups
     overdue_follow_ups = base_query.filter(
         LeadAction.follow_up_date < today
-    ).order_by(LeadAction.follow_up_date.asc()).all()
+    ).order_by(LeadAction.follow_up_date.asc()).limit(FOLLOW_UP_PAGE_LIMIT).all()
     
     # Get upcoming follow-ups
     if days_ahead == 0:
@@ -2210,7 +3853,7 @@ def admin_crm_follow_ups():
             LeadAction.follow_up_date <= end_date
         )
     
-    upcoming_actions = upcoming_query.order_by(LeadAction.follow_up_date.asc()).all()
+    upcoming_actions = upcoming_query.order_by(LeadAction.follow_up_date.asc()).limit(FOLLOW_UP_PAGE_LIMIT).all()
     
     # Group upcoming actions by date
     follow_ups_by_date = {}
@@ -2233,20 +3876,138 @@ def admin_crm_follow_ups():
                          days_ahead=days_ahead,
                          admin_filter=int(admin_filter) if admin_filter else None)
 
+FOLLOW_UP_PAGE_LIMIT = 200
+FOLLOW_UP_CALENDAR_MAX_DAYS = 62
+
+def follow_up_actions_query():
+    """Follow-up actions on open leads, with what the follow-up views render eager-loaded"""
+    return LeadAction.query.options(
+        joinedload(LeadAction.admin),
+        joinedload(LeadAction.lead).joinedload(Lead.company)
+    ).filter(
+        LeadAction.follow_up_date.isnot(None)
+    ).join(Lead).filter(
+        Lead.status.in_(OPEN_LEAD_STATUSES)
+    )
+
+@app.route('/api/admin/crm/follow-ups')
+@admin_or_super_admin_required
+def api_crm_follow_up_calendar():
+    """Follow-ups between start and end (YYYY-MM-DD, inclusive) for the calendar view"""
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d')
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d')
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'error': 'start and end dates (YYYY-MM-DD) are required'}), 400
+    if end < start or (end - start).days > FOLLOW_UP_CALENDAR_MAX_DAYS:
+        return jsonify({'success': False, 'error': f'Date window must be 0-{FOLLOW_UP_CALENDAR_MAX_DAYS} days'}), 400
+    
+    query = follow_up_actions_query().filter(
+        LeadAction.follow_up_date >= start,
+        LeadAction.follow_up_date < end + timedelta(days=1)
+    )
+    
+    admin_filter = request.args.get('admin_id', type=int)
+    if not session.get('is_super_admin'):
+        # Regular admins only see their own follow-ups
+        query = query.filter(LeadAction.admin_id == session['user_id'])
+    elif admin_filter:
+        query = query.filter(LeadAction.admin_id == admin_filter)
+    
+    actions = query.order_by(LeadAction.follow_up_date.asc(), LeadAction.id.asc()).limit(FOLLOW_UP_PAGE_LIMIT).all()
+    return jsonify({
+        'success': True,
+        'follow_ups': [{
+            'id': action.id,
+            'date': action.follow_up_date.strftime('%Y-%m-%d'),
+            'lead_id': action.lead_id,
+            'company_name': action.lead.company.company_name,
+            'action_type': action.action_type,
+            'subject': action.subject,
+            'admin_id': action.admin_id,
+            'admin_name': action.admin.contact_name or action.admin.company_name,
+            'url': url_for('admin_crm_lead_detail', lead_id=action.lead_id)
+        } for action in actions],
+        'truncated': len(actions) == FOLLOW_UP_PAGE_LIMIT
+    })
+
+def send_due_follow_up_reminders(batch_size=None):
+    """Pop due reminders off the queue and notify their admins, one batch per transaction"""
+    batch_size = batch_size or app.config['FOLLOW_UP_REMINDER_BATCH_SIZE']
+    sent = 0
+    while True:
+        due = db.session.query(FollowUpReminder, Lead.status, User.company_name)\
+            .join(Lead, FollowUpReminder.lead_id == Lead.id)\
+            .join(User, Lead.company_id == User.id)\
+            .filter(FollowUpReminder.due_at <= datetime.utcnow())\
+            .order_by(FollowUpReminder.due_at.asc())\
+            .limit(batch_size)\
+            .with_for_update(skip_locked=True, of=FollowUpReminder)\
+            .all()
+        if not due:
+            break
+        
+        notifications = []
+        for reminder, lead_status, company_name in due:
+            # Leads closed since the follow-up was scheduled need no reminder
+            if lead_status in OPEN_LEAD_STATUSES:
+                notifications.append({
+                    'user_id': reminder.admin_id,
+                    'type': 'follow_up_due',
+                    'title': f'Follow-up Due: {company_name}',
+                    'message': f'A follow-up with {company_name} is due today',
+                    'action_url': f'/admin/crm/lead/{reminder.lead_id}'
+                })
+        db.session.execute(
+            db.delete(FollowUpReminder).where(FollowUpReminder.id.in_([reminder.id for reminder, _, _ in due]))
+        )
+        # The reminder removal commits together with the notifications
+        create_notifications_bulk(notifications)
+        db.session.commit()
+        sent += len(notifications)
+        
+        if len(due) < batch_size:
+            break
+    return sent
+
+register_background_job('send_due_follow_up_reminders', app.config['FOLLOW_UP_REMINDER_INTERVAL'], send_due_follow_up_reminders)
+
+@app.cli.command('enqueue-follow-up-reminders')
+def enqueue_follow_up_reminders_command():
+    """Queue reminders for follow-ups scheduled before the reminder queue existed"""
+    queued = db.select(FollowUpReminder.action_id)
+    result = db.session.execute(db.insert(FollowUpReminder).from_select(
+        ['action_id', 'lead_id', 'admin_id', 'due_at'],
+        db.select(LeadAction.id, LeadAction.lead_id, LeadAction.admin_id, LeadAction.follow_up_date)
+        .join(Lead, LeadAction.lead_id == Lead.id)
+        .where(
+            LeadAction.follow_up_date >= datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0),
+            Lead.status.in_(OPEN_LEAD_STATUSES),
+            LeadAction.id.notin_(queued)
+        )
+    ))
+    db.session.commit()
+    print(f"Queued {result.rowcount} follow-up reminders")
+
+@app.cli.command('send-follow-up-reminders')
+def send_follow_up_reminders_command():
+    """Send every due follow-up reminder now"""
+    print(f"Sent {send_due_follow_up_reminders()} follow-up reminders")
+
 # Vendor Routes
 @app.route('/vendor/share-location')
 def vendor_share_location():
     """Public route for guest vendors to share location"""
     user = None
     if 'user_id' in session:
-        user = User.query.get(session['user_id'])
+        user = get_current_user()
     return render_template('vendor/share_location.html', user=user)
 
 @app.route('/vendor/dashboard')
 @vendor_required
 def vendor_dashboard():
     """Dashboard for registered vendors"""
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     active_locations = VendorLocation.query.filter(
         VendorLocation.user_id == user.id,
         VendorLocation.expires_at > datetime.utcnow()
@@ -2314,30 +4075,41 @@ def submit_vendor_location():
         is_registered = False
         
         if user_id:
-            user = User.query.get(user_id)
+            user = get_current_user()
             if user and user.user_type == 'vendor':
                 is_registered = True
         
-        # Create location record
-        location = VendorLocation(
-            user_id=user_id,
-            company_name=data.get('company_name').strip(),
-            contact_name=data.get('contact_name', '').strip() if data.get('contact_name') else None,
-            email=data.get('email').strip(),
-            phone=data.get('phone').strip(),
-            location_city=location_city.strip(),
-            location_state=location_state.strip(),
-            latitude=float(latitude),
-            longitude=float(longitude),
-            coverage_radius=int(data.get('coverage_radius', 100)),
-            services_provided=json.dumps(services_provided),
-            notes=data.get('notes', '').strip(),
-            is_registered_vendor=is_registered,
-            expires_at=expires_at
-        )
+        location_fields = {
+            'company_name': data.get('company_name').strip(),
+            'contact_name': data.get('contact_name', '').strip() if data.get('contact_name') else None,
+            'email': data.get('email').strip(),
+            'phone': data.get('phone').strip(),
+            'location_city': location_city.strip(),
+            'location_state': location_state.strip(),
+            'latitude': float(latitude),
+            'longitude': float(longitude),
+            'coverage_radius': int(data.get('coverage_radius', 100)),
+            'services_provided': json.dumps(services_provided),
+            'notes': data.get('notes', '').strip(),
+            'is_registered_vendor': is_registered,
+            'expires_at': expires_at
+        }
+        
+        # Registered vendors keep a single row that is updated in place
+        location = get_current_vendor_location(user_id) if is_registered else None
+        # The map already shows an unexpired row; a new or expired one appears as a fresh share
+        event_type = 'move' if location and location.expires_at > datetime.utcnow() else 'share'
+        if location is None and is_registered:
+            location = create_current_vendor_location(user_id, location_fields)
+        if location is None:
+            location = VendorLocation(user_id=user_id, **location_fields)
+            db.session.add(location)
+        else:
+            for field, value in location_fields.items():
+                setattr(location, field, value)
         
-        db.session.add(location)
         db.session.commit()
+        publish_vendor_location_event(event_type, serialize_vendor_location(location))
         
         return jsonify({
             'success': True,
@@ -2357,48 +4129,710 @@ def submit_vendor_location():
         db.session.rollback()
         return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
 
+def get_current_vendor_location(user_id):
+    """Return the registered vendor's location row (unique per vendor), expired or not"""
+    return VendorLocation.query.filter_by(user_id=user_id, is_registered_vendor=True).first()
+
+def create_current_vendor_location(user_id, location_fields):
+    """Insert the registered vendor's row, or return the one a concurrent request just inserted"""
+    location = VendorLocation(user_id=user_id, **location_fields)
+    try:
+        with db.session.begin_nested():
+            db.session.add(location)
+    except IntegrityError:
+        # ux_vendor_location_registered_user: the other request won, update its row instead
+        return get_current_vendor_location(user_id)
+    return location
+
+def retire_duplicate_vendor_locations():
+    """Archive all but the newest row of each registered vendor (data from before the unique index)"""
+    newest_ids = db.select(db.func.max(VendorLocation.id)).where(
+        VendorLocation.is_registered_vendor == True, VendorLocation.user_id.isnot(None)
+    ).group_by(VendorLocation.user_id)
+    duplicate_ids = [row[0] for row in db.session.query(VendorLocation.id).filter(
+        VendorLocation.is_registered_vendor == True,
+        VendorLocation.user_id.isnot(None),
+        VendorLocation.id.not_in(newest_ids)
+    ).all()]
+    if duplicate_ids:
+        archive_vendor_locations(duplicate_ids, datetime.utcnow())
+        db.session.commit()
+        publish_vendor_location_event('expire', {'ids': duplicate_ids})
+    return len(duplicate_ids)
+
+@app.route('/api/vendor/location-pings', methods=['POST'])
+@limiter.limit("240 per hour")
+@vendor_required
+def ingest_vendor_location_pings():
+    """Batch GPS ingestion: append pings and upsert the vendor's current position"""
+    try:
+        data = request.get_json() or {}
+        pings = data.get('pings') or []
+        
+        if not isinstance(pings, list) or len(pings) == 0:
+            return jsonify({'success': False, 'error': 'At least one ping is required'}), 400
+        if len(pings) > app.config['VENDOR_PING_MAX_BATCH']:
+            return jsonify({'success': False, 'error': f"Too many pings (max {app.config['VENDOR_PING_MAX_BATCH']} per request)"}), 400
+        
+        user_id = session['user_id']
+        now_ts = int(time.time())
+        rows = []
+        for ping in pings:
+            try:
+                latitude = float(ping['latitude'])
+                longitude = float(ping['longitude'])
+                recorded_ts = int(ping.get('timestamp') or now_ts)
+            except (KeyError, TypeError, ValueError):
+                return jsonify({'success': False, 'error': 'Each ping needs numeric latitude, longitude and optional timestamp'}), 400
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                return jsonify({'success': False, 'error': 'Ping coordinates are out of range'}), 400
+            rows.append({
+                'user_id': user_id,
+                'latitude': latitude,
+                'longitude': longitude,
+                'recorded_ts': min(recorded_ts, now_ts)
+            })
+        
+        # Single executemany for the whole batch
+        db.session.execute(db.insert(VendorLocationPing), rows)
+        
+        latest = max(rows, key=lambda row: row['recorded_ts'])
+        location = get_current_vendor_location(user_id)
+        if not location:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': 'Share your location once before sending GPS updates'}), 400
+        event_type = 'move' if location.expires_at > datetime.utcnow() else 'share'
+        
+        # Only reverse geocode when the pilot has moved a meaningful distance
+        moved_miles = None
+        if location.latitude is not None and location.longitude is not None:
+            moved_miles = calculate_distance_haversine(
+                location.latitude, location.longitude, latest['latitude'], latest['longitude']
+            )
+        if moved_miles is None or moved_miles >= app.config['VENDOR_PING_REGEOCODE_MILES']:
+            city, state = get_city_state_from_coordinates(latest['latitude'], latest['longitude'])
+            if city:
+                location.location_city = city
+            if state:
+                location.location_state = state
+        
+        location.latitude = latest['latitude']
+        location.longitude = latest['longitude']
+        location.expires_at = datetime.utcnow() + timedelta(hours=48)
+        db.session.commit()
+        publish_vendor_location_event(event_type, serialize_vendor_location(location))
+        
+        return jsonify({
+            'success': True,
+            'accepted': len(rows),
+            'location_id': location.id,
+            'expires_at': location.expires_at.strftime('%m/%d/%Y %I:%M %p')
+        })
+        
+    except Exception as e:
+        print(f"Error ingesting location pings: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
+
+def downsample_vendor_location_pings():
+    """Keep one ping per vendor per bucket once pings age, and drop pings past retention
+    
+    Only the window that aged since the previous run is downsampled, one hour-sized slice
+    per statement; the job's BackgroundJobRun.cursor holds the watermark between runs.
+    """
+    now_ts = int(time.time())
+    bucket_seconds = app.config['VENDOR_PING_DOWNSAMPLE_BUCKET_MINUTES'] * 60
+    slice_seconds = bucket_seconds * max(1, 3600 // bucket_seconds)
+    # Whole buckets only, so no bucket is split between two runs
+    downsample_before = (now_ts - app.config['VENDOR_PING_DOWNSAMPLE_AFTER_HOURS'] * 3600) // bucket_seconds * bucket_seconds
+    retention_before = now_ts - app.config['VENDOR_PING_RETENTION_DAYS'] * 86400
+    batch_size = app.config['VENDOR_PING_DELETE_BATCH_SIZE']
+    
+    removed = 0
+    while True:
+        batch_ids = [row[0] for row in db.session.query(VendorLocationPing.id).filter(
+            VendorLocationPing.recorded_ts < retention_before
+        ).limit(batch_size).all()]
+        if not batch_ids:
+            break
+        removed += db.session.execute(
+            db.delete(VendorLocationPing).where(VendorLocationPing.id.in_(batch_ids))
+        ).rowcount
+        db.session.commit()
+    
+    job_run = db.session.get(BackgroundJobRun, 'downsample_vendor_location_pings') or \
+        BackgroundJobRun(name='downsample_vendor_location_pings', runs=0, total_processed=0)
+    start = job_run.cursor
+    if start is None:
+        oldest_ts = db.session.scalar(db.select(db.func.min(VendorLocationPing.recorded_ts)))
+        start = downsample_before if oldest_ts is None else oldest_ts
+    start = max(start, retention_before) // bucket_seconds * bucket_seconds
+    
+    downsampled = 0
+    while start < downsample_before:
+        end = min(start + slice_seconds, downsample_before)
+        in_slice = (VendorLocationPing.recorded_ts >= start, VendorLocationPing.recorded_ts < end)
+        keep_ids = db.select(db.func.min(VendorLocationPing.id)).where(*in_slice).group_by(
+            VendorLocationPing.user_id,
+            VendorLocationPing.recorded_ts // bucket_seconds
+        )
+        downsampled += db.session.execute(
+            db.delete(VendorLocationPing).where(*in_slice, VendorLocationPing.id.not_in(keep_ids))
+        ).rowcount
+        job_run.cursor = end
+        db.session.add(job_run)
+        db.session.commit()
+        start = end
+    
+    return {'expired': removed, 'downsampled': downsampled}
+
+register_background_job('downsample_vendor_location_pings', 3600, downsample_vendor_location_pings)
+
 @app.route('/vendor/register-as-vendor')
 def register_as_vendor():
     """Registration form specifically for vendors"""
     return render_template('vendor/register.html')
 
+def serialize_vendor_location(location):
+    """Convert a VendorLocation to the dictionary used by the admin map"""
+    try:
+        services = json.loads(location.services_provided) if location.services_provided else []
+    except:
+        services = []
+    
+    return {
+        'id': location.id,
+        'user_id': location.user_id,
+        'company_name': location.company_name,
+        'contact_name': location.contact_name,
+        'email': location.email,
+        'phone': location.phone,
+        'location_city': location.location_city,
+        'location_state': location.location_state,
+        'latitude': location.latitude,
+        'longitude': location.longitude,
+        'coverage_radius': location.coverage_radius,
+        'services_provided': services,
+        'notes': location.notes,
+        'is_registered_vendor': location.is_registered_vendor,
+        'expires_at': location.expires_at.strftime('%m/%d/%Y %I:%M %p'),
+        'created_at': location.created_at.strftime('%m/%d/%Y %I:%M %p')
+    }
+
+def publish_vendor_location_event(event_type, data):
+    """Publish a vendor location delta ('share', 'move' or 'expire') to admin map streams"""
+    vendor_coverage_cache['version'] += 1
+    event_broker.publish('vendor_locations', event_type, data)
+
+def get_active_vendor_locations():
+    """Active (not expired) vendor locations serialized for the admin map"""
+    active_locations_query = VendorLocation.query.filter(
+        VendorLocation.expires_at > datetime.utcnow()
+    ).order_by(VendorLocation.created_at.desc()).all()
+    return [serialize_vendor_location(location) for location in active_locations_query]
+
 @app.route('/admin/vendor-locations')
 @dispatcher_or_higher_required
 def admin_vendor_locations():
     """Admin view for vendor locations and trip assignment"""
-    # Get active vendor locations (not expired)
-    active_locations_query = VendorLocation.query.filter(
-        VendorLocation.expires_at > datetime.utcnow()
-    ).order_by(VendorLocation.created_at.desc()).all()
+    return render_template('admin/vendor_locations.html', locations=get_active_vendor_locations())
+
+@app.route('/api/admin/vendor-locations')
+@dispatcher_or_higher_required
+def api_admin_vendor_locations():
+    """Active vendor locations, polled by the map when no live stream slot is free"""
+    return jsonify(get_active_vendor_locations())
+
+@app.route('/api/admin/vendor-locations/stream')
+@limiter.exempt
+@dispatcher_or_higher_required
+def admin_vendor_locations_stream():
+    """Live vendor locations: one snapshot, then share/move/expire deltas"""
+    return event_stream_response('vendor_locations', [('snapshot', get_active_vendor_locations())])
+
+# Continental US bounding box used for the coverage grid
+COVERAGE_GRID_BOUNDS = {'south': 24.5, 'north': 49.5, 'west': -125.0, 'east': -66.5}
+US_STATE_BOUNDARIES_PATH = os.path.join(app.static_folder, 'data', 'us_states.json')
+
+# Bumped on every vendor location change; the TTL covers changes made by other processes
+vendor_coverage_cache = {'version': 0, 'computed_version': None, 'computed_at': None, 'result': None}
+
+# (cell_degrees, served states) -> per-cell state code ('' = not served); boundaries never change at runtime
+coverage_cell_state_cache = {}
+
+def get_coverage_states():
+    """States the coverage grid is measured over (VENDOR_COVERAGE_STATES, default lower 48 + DC)"""
+    return app.config['VENDOR_COVERAGE_STATES'] or [
+        state for state in load_us_state_boundaries() if state not in ('AK', 'HI')
+    ]
+
+def load_us_state_boundaries():
+    """State polygons keyed by abbreviation: lists of [longitude, latitude] rings"""
+    if 'boundaries' not in coverage_cell_state_cache:
+        with open(US_STATE_BOUNDARIES_PATH) as f:
+            coverage_cell_state_cache['boundaries'] = json.load(f)['states']
+    return coverage_cell_state_cache['boundaries']
+
+def get_coverage_cell_states(lat_centers, lng_centers, cell_degrees, states):
+    """State code of every grid cell centre, or '' for cells outside the served states (ocean, Canada, Mexico)"""
+    import numpy as np
+    
+    key = (cell_degrees, tuple(sorted(states)))
+    if key in coverage_cell_state_cache:
+        return coverage_cell_state_cache[key]
+    
+    lat, lng = np.meshgrid(lat_centers, lng_centers, indexing='ij')
+    lat, lng = lat.ravel(), lng.ravel()
+    cell_states = np.full(lat.shape, '', dtype='<U2')
+    boundaries = load_us_state_boundaries()
+    for state in states:
+        rings = [np.asarray(ring, dtype=float) for ring in boundaries.get(state, [])]
+        if not rings:
+            continue
+        all_points = np.vstack(rings)
+        candidates = np.flatnonzero(
+            (lng >= all_points[:, 0].min()) & (lng <= all_points[:, 0].max()) &
+            (lat >= all_points[:, 1].min()) & (lat <= all_points[:, 1].max()) & (cell_states == '')
+        )
+        if not candidates.size:
+            continue
+        px, py = lng[candidates, None], lat[candidates, None]
+        inside = np.zeros(candidates.size, dtype=bool)
+        for ring in rings:
+            # Even-odd ray casting: count edges crossed by a ray running east from each point
+            x1, y1 = ring[:, 0], ring[:, 1]
+            x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+            straddles = (y1 > py) != (y2 > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crossing_x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            inside ^= ((straddles & (px < crossing_x)).sum(axis=1) % 2).astype(bool)
+        cell_states[candidates[inside]] = state
+    
+    coverage_cell_state_cache[key] = cell_states
+    return cell_states
+
+def compute_vendor_coverage_grid(cell_degrees=None, vendor_chunk_size=500):
+    """Count, per served grid cell, the active vendors whose coverage radius reaches the cell centre"""
+    import numpy as np
+    
+    cell_degrees = cell_degrees or app.config['VENDOR_COVERAGE_CELL_DEGREES']
+    bounds = COVERAGE_GRID_BOUNDS
+    lat_centers = np.arange(bounds['south'] + cell_degrees / 2, bounds['north'], cell_degrees)
+    lng_centers = np.arange(bounds['west'] + cell_degrees / 2, bounds['east'], cell_degrees)
+    
+    # Only cells whose centre lies inside a served state are measured
+    cell_states = get_coverage_cell_states(lat_centers, lng_centers, cell_degrees, get_coverage_states())
+    served = np.flatnonzero(cell_states != '')
+    rows, cols = np.divmod(served, lng_centers.shape[0])
+    cell_lat, cell_lng = np.radians(lat_centers[rows]), np.radians(lng_centers[cols])
+    
+    def unit_vectors(lat, lng):
+        return np.column_stack((np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)))
+    
+    cell_vectors = unit_vectors(cell_lat, cell_lng)
+    
+    vendors = db.session.query(
+        VendorLocation.latitude, VendorLocation.longitude, VendorLocation.coverage_radius
+    ).filter(
+        VendorLocation.expires_at > datetime.utcnow(),
+        VendorLocation.latitude.isnot(None),
+        VendorLocation.longitude.isnot(None)
+    ).all()
+    vendor_array = np.array(vendors, dtype=float).reshape(-1, 3)
+    vendor_vectors = unit_vectors(np.radians(vendor_array[:, 0]), np.radians(vendor_array[:, 1]))
+    vendor_radius = np.nan_to_num(vendor_array[:, 2], nan=100.0)
+    
+    # A cell is reached when the great-circle angle to it is within radius / R,
+    # i.e. when the dot product of the unit vectors is at least cos(radius / R)
+    R = 3959  # Earth's radius in miles
+    min_dot = np.cos(np.minimum(vendor_radius / R, np.pi))
     
-    # Convert to dictionaries for JSON serialization
-    active_locations = []
-    for location in active_locations_query:
-        try:
-            services = json.loads(location.services_provided) if location.services_provided else []
-        except:
-            services = []
-            
-        active_locations.append({
-            'id': location.id,
-            'user_id': location.user_id,
-            'company_name': location.company_name,
-            'contact_name': location.contact_name,
-            'email': location.email,
-            'phone': location.phone,
-            'location_city': location.location_city,
-            'location_state': location.location_state,
-            'latitude': location.latitude,
-            'longitude': location.longitude,
-            'coverage_radius': location.coverage_radius,
-            'services_provided': services,
-            'notes': location.notes,
-            'is_registered_vendor': location.is_registered_vendor,
-            'expires_at': location.expires_at.strftime('%m/%d/%Y %I:%M %p'),
-            'created_at': location.created_at.strftime('%m/%d/%Y %I:%M %p')
-        })
+    counts = np.zeros(cell_vectors.shape[0], dtype=np.int32)
+    # Vendors are processed in chunks so memory stays bounded at (chunk x cells)
+    for start in range(0, vendor_vectors.shape[0], vendor_chunk_size):
+        chunk = slice(start, start + vendor_chunk_size)
+        dots = vendor_vectors[chunk] @ cell_vectors.T
+        counts += (dots >= min_dot[chunk, None]).sum(axis=0, dtype=np.int32)
     
-    return render_template('admin/vendor_locations.html', locations=active_locations)
+    gap_cells = int((counts == 0).sum())
+    state_gaps = Counter(cell_states[served][counts == 0].tolist())
+    return {
+        'bounds': bounds,
+        'cell_degrees': cell_degrees,
+        'vendor_count': int(vendor_vectors.shape[0]),
+        'served_cells': int(counts.shape[0]),
+        'gap_cells': gap_cells,
+        'coverage_percent': round(100 * (1 - gap_cells / counts.shape[0]), 1) if counts.size else 0.0,
+        'max_count': int(counts.max()) if counts.size else 0,
+        'state_gaps': dict(state_gaps.most_common()),
+        # [row, col, count] for served cells only; row 0 is the southernmost band, col 0 the westernmost
+        'cells': np.column_stack((rows, cols, counts)).tolist()
+    }
+
+def get_vendor_coverage_grid():
+    """Cached coverage grid, recomputed after any vendor location change"""
+    cache = vendor_coverage_cache
+    ttl = timedelta(seconds=app.config['VENDOR_LOCATION_EXPIRY_INTERVAL'])
+    if (cache['result'] is None or cache['computed_version'] != cache['version']
+            or datetime.utcnow() - cache['computed_at'] > ttl):
+        version = cache['version']
+        cache['result'] = compute_vendor_coverage_grid()
+        cache['computed_version'] = version
+        cache['computed_at'] = datetime.utcnow()
+    return cache['result'], cache['computed_at']
+
+@app.route('/api/admin/vendor-coverage')
+@dispatcher_or_higher_required
+def admin_vendor_coverage():
+    """Coverage heat layer for the admin vendor map"""
+    try:
+        result, computed_at = get_vendor_coverage_grid()
+        return jsonify({'success': True, 'computed_at': computed_at.isoformat(), **result})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+# ================== VENDOR DIRECTORY IMPORT ==================
+
+VENDOR_SERVICES = ['Chase/Lead', 'HP (Height Pole)', 'Route Survey', 'Steer']
+VENDOR_IMPORT_MAX_REPORTED_ERRORS = 500
+
+VENDOR_IMPORT_JOB_FIELDS = (
+    'status', 'started_at', 'finished_at', 'rows_processed', 'users_created',
+    'locations_created', 'locations_updated', 'error_count'
+)
+
+def new_vendor_import_job(csv_data=None):
+    """Create a job record; the import works on the returned dict and saves it after each chunk
+    
+    With csv_data the job stays queued for the background worker (process_queued_vendor_imports).
+    """
+    job = {
+        'id': uuid.uuid4().hex,
+        'status': 'queued',
+        'started_at': None,
+        'finished_at': None,
+        'rows_processed': 0,
+        'users_created': 0,
+        'locations_created': 0,
+        'locations_updated': 0,
+        'error_count': 0,
+        'errors': []
+    }
+    db.session.add(VendorImportJob(id=job['id'], status=job['status'], errors='[]', csv_data=csv_data))
+    db.session.commit()
+    return job
+
+def load_vendor_import_job(record):
+    """The working dict of a stored job (the inverse of save_vendor_import_job)"""
+    return {
+        'id': record.id,
+        **{field: getattr(record, field) for field in VENDOR_IMPORT_JOB_FIELDS},
+        'errors': json.loads(record.errors)
+    }
+
+def save_vendor_import_job(job):
+    """Persist a job's progress so the status endpoint can be served by any worker"""
+    db.session.execute(db.update(VendorImportJob).where(VendorImportJob.id == job['id']).values(
+        errors=json.dumps(job['errors']), **{field: job[field] for field in VENDOR_IMPORT_JOB_FIELDS}
+    ))
+    db.session.commit()
+
+def serialize_vendor_import_job(job):
+    return load_vendor_import_job(job)
+
+def record_vendor_import_error(job, row_number, message):
+    job['error_count'] += 1
+    if len(job['errors']) < VENDOR_IMPORT_MAX_REPORTED_ERRORS:
+        job['errors'].append({'row': row_number, 'error': message})
+
+def validate_vendor_import_row(row):
+    """Validate one CSV row, returning (record, error)"""
+    row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+    
+    company_name = row.get('company_name', '')
+    email = row.get('email', '').lower()
+    phone = row.get('phone', '')
+    city = row.get('city', '')
+    state = row.get('state', '')
+    
+    if not company_name or len(company_name) > 100:
+        return None, 'Company name is required (max 100 characters)'
+    if not email or len(email) > 120 or not re.match(r'^[^@]+@[^@]+\.[^@]+$', email):
+        return None, 'A valid email address is required'
+    if not phone or len(phone) > 20:
+        return None, 'Phone number is required (max 20 characters)'
+    if not city or not state:
+        return None, 'City and state are required'
+    
+    services_lookup = {service.lower(): service for service in VENDOR_SERVICES}
+    services = []
+    for service in re.split(r'[;|]', row.get('services', '')):
+        if service.strip():
+            if service.strip().lower() not in services_lookup:
+                return None, f'Unknown service: {service.strip()}'
+            services.append(services_lookup[service.strip().lower()])
+    if not services:
+        return None, 'At least one service is required'
+    
+    try:
+        coverage_radius = int(row.get('coverage_radius') or 100)
+        latitude = float(row['latitude']) if row.get('latitude') else None
+        longitude = float(row['longitude']) if row.get('longitude') else None
+    except ValueError:
+        return None, 'Coverage radius, latitude and longitude must be numeric'
+    if not 1 <= coverage_radius <= 500:
+        return None, 'Coverage radius must be between 1 and 500 miles'
+    if (latitude is None) != (longitude is None):
+        return None, 'Latitude and longitude must be provided together'
+    
+    return {
+        'company_name': company_name,
+        'contact_name': row.get('contact_name') or None,
+        'email': email,
+        'phone': phone,
+        'city': city,
+        'state': state,
+        'latitude': latitude,
+        'longitude': longitude,
+        'coverage_radius': coverage_radius,
+        'services': services,
+        'notes': row.get('notes', '')
+    }, None
+
+def import_vendor_chunk(chunk, job):
+    """Validate, geocode and bulk insert one chunk of (row_number, row) pairs"""
+    records = []
+    seen_emails = set()
+    for row_number, row in chunk:
+        record, error = validate_vendor_import_row(row)
+        if not error and record['email'] in seen_emails:
+            error = 'Duplicate email in file'
+        if error:
+            record_vendor_import_error(job, row_number, error)
+            continue
+        seen_emails.add(record['email'])
+        records.append((row_number, record))
+    
+    if not records:
+        return
+    
+    try:
+        # One cached geocoding pass for every address in the chunk that lacks coordinates
+        missing = {(record['city'], record['state']) for _, record in records if record['latitude'] is None}
+        geocoded = geocode_city_states_cached(missing)
+        
+        located = []
+        for row_number, record in records:
+            if record['latitude'] is None:
+                record['latitude'], record['longitude'] = geocoded.get(
+                    normalize_geocode_key(record['city'], record['state']), (None, None)
+                )
+                if record['latitude'] is None:
+                    record_vendor_import_error(job, row_number, f"Could not geocode {record['city']}, {record['state']}")
+                    continue
+            located.append((row_number, record))
+        
+        # Emails are compared case-insensitively: existing accounts may be stored with mixed case
+        emails = [record['email'] for _, record in located]
+        existing_users = {
+            user.email.lower(): user for user in db.session.query(User.id, User.email, User.user_type)
+            .filter(db.func.lower(User.email).in_(emails)).all()
+        }
+        
+        new_users = []
+        for row_number, record in list(located):
+            existing = existing_users.get(record['email'])
+            if existing and existing.user_type != 'vendor':
+                record_vendor_import_error(job, row_number, 'Email belongs to a non-vendor account')
+                located.remove((row_number, record))
+            elif not existing:
+                # Imported pilots have no password until an admin resets it for them
+                new_users.append({
+                    'company_name': record['company_name'],
+                    'contact_name': record['contact_name'],
+                    'email': record['email'],
+                    'phone_number': record['phone'],
+                    'user_type': 'vendor',
+                    'is_approved': True,
+                    'created_at': datetime.utcnow()
+                })
+        
+        if new_users:
+            db.session.execute(db.insert(User), new_users)
+        user_ids = dict(db.session.query(db.func.lower(User.email), User.id).filter(
+            db.func.lower(User.email).in_([record['email'] for _, record in located])
+        ).all())
+        
+        # Vendors that already have an active share get it updated in place (one current row per vendor)
+        current_location_ids = dict(db.session.query(
+            VendorLocation.user_id, db.func.max(VendorLocation.id)
+        ).filter(
+            VendorLocation.user_id.in_(list(user_ids.values())),
+            VendorLocation.expires_at > datetime.utcnow()
+        ).group_by(VendorLocation.user_id).all())
+        
+        expires_at = datetime.utcnow() + timedelta(hours=48)
+        location_rows = [{
+            'user_id': user_ids[record['email']],
+            'company_name': record['company_name'],
+            'contact_name': record['contact_name'],
+            'email': record['email'],
+            'phone': record['phone'],
+            'location_city': record['city'],
+            'location_state': record['state'],
+            'latitude': record['latitude'],
+            'longitude': record['longitude'],
+            'coverage_radius': record['coverage_radius'],
+            'services_provided': json.dumps(record['services']),
+            'notes': record['notes'],
+            'is_registered_vendor': True,
+            'expires_at': expires_at,
+            'created_at': datetime.utcnow()
+        } for _, record in located]
+        
+        updated_rows = []
+        inserted_rows = []
+        for location_row in location_rows:
+            location_id = current_location_ids.get(location_row['user_id'])
+            if location_id:
+                location_row.pop('created_at')
+                updated_rows.append({'id': location_id, **location_row})
+            else:
+                inserted_rows.append(location_row)
+        if updated_rows:
+            db.session.execute(db.update(VendorLocation), updated_rows)
+        if inserted_rows:
+            db.session.execute(db.insert(VendorLocation), inserted_rows)
+        
+        db.session.commit()
+        job['users_created'] += len(new_users)
+        job['locations_created'] += len(inserted_rows)
+        job['locations_updated'] += len(updated_rows)
+        
+    except Exception as e:
+        db.session.rollback()
+        for row_number, _ in records:
+            record_vendor_import_error(job, row_number, f'Database error: {str(e)}')
+
+def import_vendor_directory(csv_file, job, chunk_size=None):
+    """Stream a vendor directory CSV into User/VendorLocation rows, chunk by chunk
+    
+    Columns: company_name, contact_name, email, phone, city, state, latitude, longitude,
+    coverage_radius, services (separated by ';' or '|'), notes. Only one chunk is held in
+    memory at a time and invalid rows are reported without aborting the import.
+    """
+    chunk_size = chunk_size or app.config['VENDOR_IMPORT_CHUNK_SIZE']
+    job['status'] = 'running'
+    job['started_at'] = datetime.utcnow()
+    save_vendor_import_job(job)
+    
+    chunk = []
+    for row_number, row in enumerate(csv.DictReader(csv_file), start=2):
+        chunk.append((row_number, row))
+        job['rows_processed'] += 1
+        if len(chunk) >= chunk_size:
+            import_vendor_chunk(chunk, job)
+            save_vendor_import_job(job)
+            chunk = []
+    if chunk:
+        import_vendor_chunk(chunk, job)
+    
+    job['status'] = 'completed'
+    job['finished_at'] = datetime.utcnow()
+    save_vendor_import_job(job)
+    
+    # Imported shares change the map wholesale: drop the coverage cache and resync live streams
+    vendor_coverage_cache['version'] += 1
+    event_broker.reset('vendor_locations')
+    return job
+
+def process_queued_vendor_imports():
+    """Run queued vendor imports in upload order (registered background job)"""
+    processed = 0
+    while True:
+        record = VendorImportJob.query.filter_by(status='queued')\
+            .filter(VendorImportJob.csv_data.isnot(None))\
+            .order_by(VendorImportJob.created_at).first()
+        if not record:
+            return processed
+        job = load_vendor_import_job(record)
+        csv_file = io.StringIO(record.csv_data, newline='')
+        try:
+            import_vendor_directory(csv_file, job)
+        except Exception as e:
+            app.logger.error(f"Vendor import {job['id']} failed: {e}")
+            db.session.rollback()
+            job['status'] = 'failed'
+            job['finished_at'] = datetime.utcnow()
+            record_vendor_import_error(job, None, str(e))
+            save_vendor_import_job(job)
+        # The upload is only needed until the import ends
+        db.session.execute(db.update(VendorImportJob).where(VendorImportJob.id == job['id']).values(csv_data=None))
+        db.session.commit()
+        processed += 1
+
+register_background_job('process_queued_vendor_imports', app.config['VENDOR_IMPORT_POLL_INTERVAL'], process_queued_vendor_imports)
+
+def fail_interrupted_vendor_import_jobs():
+    """Mark imports left 'running' by a stopped worker as failed"""
+    interrupted = VendorImportJob.query.filter_by(status='running').all()
+    for record in interrupted:
+        job = load_vendor_import_job(record)
+        job['status'] = 'failed'
+        job['finished_at'] = datetime.utcnow()
+        record_vendor_import_error(job, None, 'Interrupted: the background worker restarted during the import')
+        save_vendor_import_job(job)
+        db.session.execute(db.update(VendorImportJob).where(VendorImportJob.id == job['id']).values(csv_data=None))
+        db.session.commit()
+    if interrupted:
+        app.logger.warning(f"Marked {len(interrupted)} interrupted vendor import(s) as failed")
+    return len(interrupted)
+
+@app.cli.command('import-vendors')
+@click.argument('path')
+def import_vendors_command(path):
+    """Import a vendor directory CSV"""
+    job = new_vendor_import_job()
+    with open(path, newline='', encoding='utf-8-sig') as csv_file:
+        import_vendor_directory(csv_file, job)
+    print(f"Processed {job['rows_processed']} rows: {job['users_created']} vendors created, "
+          f"{job['locations_created']} locations created, {job['locations_updated']} updated, "
+          f"{job['error_count']} errors")
+    for error in job['errors']:
+        print(f"  Row {error['row']}: {error['error']}")
+
+@app.route('/api/admin/vendors/import', methods=['POST'])
+@admin_or_super_admin_required
+def admin_import_vendors():
+    """Queue an uploaded vendor directory CSV for import by the background worker"""
+    try:
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            return jsonify({'success': False, 'error': 'A CSV file is required'}), 400
+        if not upload.filename.lower().endswith('.csv'):
+            return jsonify({'success': False, 'error': 'Only CSV files are supported'}), 400
+        
+        try:
+            csv_data = upload.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            return jsonify({'success': False, 'error': 'The CSV file must be UTF-8 encoded'}), 400
+        
+        # Stored with the job: the worker process picks it up, and it may run on another machine
+        job = new_vendor_import_job(csv_data)
+        
+        return jsonify({'success': True, 'job_id': job['id'], 'status_url': url_for('admin_import_vendors_status', job_id=job['id'])}), 202
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/admin/vendors/import/<job_id>')
+@admin_or_super_admin_required
+def admin_import_vendors_status(job_id):
+    """Progress and per-row errors of a vendor import job"""
+    job = db.session.get(VendorImportJob, job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Import job not found'}), 404
+    return jsonify({'success': True, 'job': serialize_vendor_import_job(job)})
 
 @app.route('/admin/search-vendors', methods=['POST'])
 @dispatcher_or_higher_required
@@ -2468,36 +4902,69 @@ def search_vendors():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+# Vendor location expiry - archives expired shares then deletes them in bounded batches
+VENDOR_LOCATION_ARCHIVE_COLUMNS = [
+    'user_id', 'company_name', 'contact_name', 'email', 'phone', 'location_city',
+    'location_state', 'latitude', 'longitude', 'coverage_radius', 'services_provided',
+    'notes', 'is_registered_vendor', 'expires_at', 'created_at'
+]
+
+def archive_vendor_locations(location_ids, archived_at):
+    """Copy the given vendor locations into vendor_location_history and delete them (caller commits)"""
+    archive_select = db.select(
+        VendorLocation.id,
+        *[getattr(VendorLocation, column) for column in VENDOR_LOCATION_ARCHIVE_COLUMNS],
+        db.literal(archived_at)
+    ).where(VendorLocation.id.in_(location_ids))
+    db.session.execute(
+        db.insert(VendorLocationHistory).from_select(
+            ['location_id'] + VENDOR_LOCATION_ARCHIVE_COLUMNS + ['archived_at'], archive_select
+        )
+    )
+    db.session.execute(
+        db.delete(VendorLocation).where(VendorLocation.id.in_(location_ids))
+    )
+
+def expire_vendor_locations(batch_size=None):
+    """Move expired vendor locations into vendor_location_history and delete them"""
+    batch_size = batch_size or app.config['VENDOR_LOCATION_EXPIRY_BATCH_SIZE']
+    cutoff = datetime.utcnow()
+    expired_count = 0
+    
+    while True:
+        # Only a bounded list of ids is held in memory per batch
+        batch_ids = [row[0] for row in db.session.query(VendorLocation.id).filter(
+            VendorLocation.expires_at <= cutoff
+        ).order_by(VendorLocation.id).limit(batch_size).all()]
+        if not batch_ids:
+            break
+        
+        archive_vendor_locations(batch_ids, cutoff)
+        db.session.commit()
+        publish_vendor_location_event('expire', {'ids': batch_ids})
+        expired_count += len(batch_ids)
+        
+        if len(batch_ids) < batch_size:
+            break
+    
+    return expired_count
+
+register_background_job('expire_vendor_locations', app.config['VENDOR_LOCATION_EXPIRY_INTERVAL'], expire_vendor_locations)
+
+@app.cli.command('expire-vendor-locations')
+def expire_vendor_locations_command():
+    """Archive and delete expired vendor locations"""
+    expired_count = expire_vendor_locations()
+    print(f"Archived {expired_count} expired vendor location(s)")
+
 @app.route('/api/admin/check-expired-locations', methods=['POST'])
 @dispatcher_or_higher_required
 def check_expired_locations():
     """Check for and remove expired pilot locations"""
     try:
-        # Get current time for comparison
-        current_time = datetime.utcnow()
-        
-        # Get all locations for debugging
-        all_locations = VendorLocation.query.all()
-        active_locations = VendorLocation.query.filter(
-            VendorLocation.expires_at > current_time
-        ).all()
-        
-        # Find expired locations
-        expired_locations = VendorLocation.query.filter(
-            VendorLocation.expires_at <= current_time
-        ).all()
-        
-        expired_count = len(expired_locations)
-        
-        # Delete expired locations
-        for location in expired_locations:
-            db.session.delete(location)
-        
-        db.session.commit()
-        
-        # Create detailed message
-        total_locations = len(all_locations)
-        active_count = len(active_locations)
+        expired_count = expire_vendor_locations()
+        active_count = VendorLocation.query.count()
+        total_locations = active_count + expired_count
         
         if expired_count > 0:
             message = f'Removed {expired_count} expired location{"s" if expired_count != 1 else ""} from the system. ({active_count} locations remain active)'
@@ -2520,6 +4987,47 @@ def check_expired_locations():
         db.session.rollback()
         return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
 
+@app.route('/api/admin/vendor-locations/expiry-metrics')
+@dispatcher_or_higher_required
+def vendor_location_expiry_metrics():
+    """Counts for the vendor location expiry job"""
+    try:
+        current_time = datetime.utcnow()
+        active_count = db.session.query(db.func.count(VendorLocation.id)).filter(
+            VendorLocation.expires_at > current_time
+        ).scalar()
+        pending_expiry_count = db.session.query(db.func.count(VendorLocation.id)).filter(
+            VendorLocation.expires_at <= current_time
+        ).scalar()
+        archived_count = db.session.query(db.func.count(VendorLocationHistory.id)).scalar()
+        
+        # Recorded by whichever process runs the job (normally the Procfile worker)
+        job_run = db.session.get(BackgroundJobRun, 'expire_vendor_locations')
+        interval_seconds = app.config['VENDOR_LOCATION_EXPIRY_INTERVAL']
+        last_run_at = job_run.last_run_at if job_run else None
+        ran_recently = last_run_at is not None and current_time - last_run_at <= timedelta(seconds=2 * interval_seconds)
+        
+        return jsonify({
+            'success': True,
+            'active_count': active_count,
+            'pending_expiry_count': pending_expiry_count,
+            'archived_count': archived_count,
+            'job': {
+                'enabled': app.config['ENABLE_BACKGROUND_JOBS'] or ran_recently,
+                'interval_seconds': interval_seconds,
+                'batch_size': app.config['VENDOR_LOCATION_EXPIRY_BATCH_SIZE'],
+                'runs': job_run.runs if job_run else 0,
+                'last_run_at': last_run_at.isoformat() if last_run_at else None,
+                'last_expired_count': json.loads(job_run.last_result) if job_run and job_run.last_result else 0,
+                'last_duration_ms': job_run.last_duration_ms if job_run else 0,
+                'total_expired': job_run.total_processed if job_run else 0,
+                'last_error': job_run.last_error if job_run else None
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
 @app.route('/admin/manage-users')
 @admin_or_super_admin_required
 def admin_manage_users():
@@ -2545,6 +5053,18 @@ def admin_vendors():
     vendors = User.query.filter_by(user_type='vendor', is_admin=False).order_by(User.created_at.desc()).all()
     return render_template('admin/vendors.html', vendors=vendors)
 
+def log_admin_status_change(user, description):
+    """Audit an account status change made by the current admin"""
+    create_audit_log(
+        user_id=user.id,
+        action_type='status_change',
+        action_description=description,
+        changed_by_admin=True,
+        admin_user_id=session.get('user_id'),
+        ip_address=request.remote_addr,
+        user_agent=request.headers.get('User-Agent', '')
+    )
+
 @app.route('/admin/approve-user/<int:user_id>', methods=['POST'])
 @admin_or_super_admin_required
 def approve_user(user_id):
@@ -2552,7 +5072,9 @@ def approve_user(user_id):
     user = User.query.get_or_404(user_id)
     if user.user_type == 'trucking_company':
         user.is_approved = True
+        bump_claims_version(user)
         db.session.commit()
+        log_admin_status_change(user, 'Account approved by admin')
         return jsonify({'success': True, 'message': f'{user.company_name} has been approved'})
     else:
         return jsonify({'success': False, 'error': 'Only trucking companies require approval'}), 400
@@ -2563,7 +5085,9 @@ def suspend_user(user_id):
     """Suspend a user"""
     user = User.query.get_or_404(user_id)
     user.is_suspended = True
+    bump_claims_version(user)
     db.session.commit()
+    log_admin_status_change(user, 'Account suspended by admin')
     return jsonify({'success': True, 'message': f'{user.company_name} has been suspended'})
 
 @app.route('/admin/unsuspend-user/<int:user_id>', methods=['POST'])
@@ -2572,7 +5096,9 @@ def unsuspend_user(user_id):
     """Unsuspend a user"""
     user = User.query.get_or_404(user_id)
     user.is_suspended = False
+    bump_claims_version(user)
     db.session.commit()
+    log_admin_status_change(user, 'Account unsuspended by admin')
     return jsonify({'success': True, 'message': f'{user.company_name} has been unsuspended'})
 
 @app.route('/admin/user-details/<int:user_id>')
@@ -2616,36 +5142,21 @@ def admin_user_details(user_id):
                 'total_routes': total_routes
             }
         
-        # Create simplified audit history (since we don't have a full audit system)
-        audit_history = [
-            {
+        # Latest audit events; older ones via /api/admin/audit-log with the cursor
+        audit_rows, audit_next_cursor = keyset_paginate(audit_event_query(user_id=user.id), AuditEvent, None, 20)
+        audit_history = [serialize_audit_event(row) for row in audit_rows]
+        if audit_next_cursor is None:
+            audit_history.append({
                 'action_type': 'registration',
                 'action_description': f'Account created as {user.user_type}',
                 'changed_by_admin': False,
                 'admin_name': None,
                 'time_ago': f"{account_age_days} days ago"
-            }
-        ]
-        
-        # Add approval event if approved
-        if user.is_approved and user.user_type == 'trucking_company':
-            audit_history.append({
-                'action_type': 'status_change',
-                'action_description': 'Account approved by admin',
-                'changed_by_admin': True,
-                'admin_name': 'Admin',
-                'time_ago': 'Recently'
             })
         
-        # Add suspension events if applicable
-        if user.is_suspended:
-            audit_history.append({
-                'action_type': 'status_change',
-                'action_description': 'Account suspended by admin',
-                'changed_by_admin': True,
-                'admin_name': 'Admin',
-                'time_ago': 'Recently'
-            })
+        total_logins, last_login = db.session.query(
+            db.func.count(AuditEvent.id), db.func.max(AuditEvent.created_at)
+        ).filter(AuditEvent.user_id == user.id, AuditEvent.action_type == 'login').one()
         
         # Recent activity for trucking companies
         recent_activity = []
@@ -2739,10 +5250,11 @@ def admin_user_details(user_id):
                 'is_suspended': user.is_suspended,
                 'created_at': user.created_at.strftime('%m/%d/%Y %I:%M %p'),
                 'account_age_days': account_age_days,
-                'total_logins': 'N/A',  # Would need login tracking
-                'last_login': 'N/A',    # Would need login tracking
+                'total_logins': total_logins,
+                'last_login': last_login.strftime('%m/%d/%Y %I:%M %p') if last_login else 'Never',
                 'activity_stats': formatted_activity_stats,
                 'audit_history': audit_history,
+                'audit_next_cursor': audit_next_cursor,
                 'login_history': []  # Empty for now since we don't track logins
             }
         })
@@ -2750,6 +5262,64 @@ def admin_user_details(user_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+AUDIT_EXPORT_COLUMNS = [
+    'id', 'user_id', 'action_type', 'action_description', 'field_changed', 'old_value',
+    'new_value', 'changed_by_admin', 'admin_name', 'ip_address', 'user_agent', 'created_at'
+]
+
+# Leading characters that make spreadsheet apps evaluate a cell as a formula
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def csv_safe(value):
+    """Neutralise user-controlled text that a spreadsheet would run as a formula"""
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+@app.route('/api/admin/audit-log')
+@admin_or_super_admin_required
+def api_admin_audit_log():
+    """Audit events newest first, keyset-paginated; filter by user_id and action_type"""
+    try:
+        rows, next_cursor = keyset_paginate(
+            audit_event_query(request.args.get('user_id', type=int), request.args.get('action_type')),
+            AuditEvent, request.args.get('cursor'), request.args.get('limit', 50, type=int)
+        )
+        return jsonify({
+            'success': True,
+            'events': [serialize_audit_event(row) for row in rows],
+            'next_cursor': next_cursor
+        })
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/admin/audit-log/export.csv')
+@admin_or_super_admin_required
+def api_admin_audit_log_export():
+    """Stream matching audit events as CSV without loading them all into memory"""
+    user_id = request.args.get('user_id', type=int)
+    query = audit_event_query(user_id, request.args.get('action_type'))\
+        .order_by(AuditEvent.created_at.desc(), AuditEvent.id.desc())
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(AUDIT_EXPORT_COLUMNS)
+        for row in query.yield_per(1000):
+            event = serialize_audit_event(row)
+            writer.writerow([csv_safe(event[column]) for column in AUDIT_EXPORT_COLUMNS])
+            if buffer.tell() > 65536:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    filename = f'audit-log-user-{user_id}.csv' if user_id else 'audit-log.csv'
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
 def calculate_distance_haversine(lat1, lon1, lat2, lon2):
     """Calculate distance between two points using haversine formula"""
     R = 3959  # Earth's radius in miles
@@ -2767,7 +5337,7 @@ def order_pilot_car():
     """Pilot car order form - accessible to both registered and guest users"""
     user = None
     if 'user_id' in session:
-        user = User.query.get(session['user_id'])
+        user = get_current_user()
         # Check if trucking company user is approved
         if user and user.user_type == 'trucking_company' and not user.is_approved and not user.is_admin:
             flash('Your account is pending approval. You can still place orders as a guest.')
@@ -2845,19 +5415,15 @@ def admin_orders():
     """Admin view for all pilot car orders"""
     orders = PilotCarOrder.query.order_by(PilotCarOrder.created_at.desc()).all()
     
-    # Calculate statistics
-    total_orders = len(orders)
-    pending_orders = len([o for o in orders if o.status == 'pending'])
-    confirmed_orders = len([o for o in orders if o.status == 'confirmed'])
-    completed_orders = len([o for o in orders if o.status == 'completed'])
-    cancelled_orders = len([o for o in orders if o.status == 'cancelled'])
+    # Calculate statistics from the order rollup
+    status_counts = get_order_status_counts()
     
     stats = {
-        'total': total_orders,
-        'pending': pending_orders,
-        'confirmed': confirmed_orders,
-        'completed': completed_orders,
-        'cancelled': cancelled_orders
+        'total': sum(status_counts.values()),
+        'pending': status_counts.get('pending', 0),
+        'confirmed': status_counts.get('confirmed', 0),
+        'completed': status_counts.get('completed', 0),
+        'cancelled': status_counts.get('cancelled', 0)
     }
     
     return render_template('admin/orders.html', orders=orders, stats=stats)
@@ -2911,7 +5477,7 @@ def assign_lead(lead_id):
             lead.status = 'assigned'
         else:
             # Assign to current user
-            current_user = User.query.get(session['user_id'])
+            current_user = get_current_user()
             lead.assigned_admin_id = current_user.id
             lead.status = 'assigned'
         
@@ -2932,6 +5498,64 @@ def assign_lead(lead_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 400
 
+@app.route('/admin/crm/bulk-assign', methods=['POST'])
+@admin_or_super_admin_required
+def bulk_assign_leads():
+    """Assign a selection of leads in one transaction
+    
+    Accepts lead_ids and admin_id (form fields or JSON). admin_id 'auto' spreads the
+    leads over admins by workload; omitting it assigns them to the current user.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        lead_ids = data.get('lead_ids') or request.form.getlist('lead_ids')
+        admin_id = data.get('admin_id', request.form.get('admin_id'))
+        
+        lead_ids = sorted({int(lead_id) for lead_id in lead_ids})
+        if not lead_ids:
+            return jsonify({'success': False, 'message': 'No leads selected'}), 400
+        if len(lead_ids) > KEYSET_MAX_PAGE_SIZE * 5:
+            return jsonify({'success': False, 'message': f'At most {KEYSET_MAX_PAGE_SIZE * 5} leads per request'}), 400
+        
+        leads = Lead.query.options(joinedload(Lead.company)).filter(
+            Lead.id.in_(lead_ids),
+            Lead.status.notin_(['converted', 'lost'])
+        ).order_by(Lead.id).all()
+        if not leads:
+            return jsonify({'success': False, 'message': 'No assignable leads found'}), 404
+        
+        if admin_id == 'auto':
+            owners = pick_lead_owners(len(leads))
+            if not owners:
+                return jsonify({'success': False, 'message': 'No admins available for routing'}), 400
+        else:
+            if admin_id:
+                target_admin = User.query.get(int(admin_id))
+                if not target_admin or not target_admin.is_admin:
+                    return jsonify({'success': False, 'message': 'Invalid admin'}), 400
+                owner = target_admin.id
+            else:
+                owner = session['user_id']
+            owners = [owner] * len(leads)
+        
+        assign_leads(leads, owners)
+        notify_lead_assignments(leads)
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f'{len(leads)} leads assigned',
+            'assigned': {lead.id: lead.assigned_admin_id for lead in leads},
+            'skipped': sorted(set(lead_ids) - {lead.id for lead in leads})
+        })
+        
+    except ValueError:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Invalid lead or admin id'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+
 @app.route('/admin/crm/convert-lead/<int:lead_id>', methods=['POST'])
 @admin_or_super_admin_required
 def convert_lead(lead_id):
@@ -2980,7 +5604,7 @@ def add_lead_action(lead_id):
     """Add action to lead"""
     try:
         lead = Lead.query.get_or_404(lead_id)
-        current_user = User.query.get(session['user_id'])
+        current_user = get_current_user()
         
         action_type = request.form.get('action_type')
         subject = request.form.get('subject')
@@ -3018,6 +5642,13 @@ def add_lead_action(lead_id):
             lead.status = 'in_progress'  # Change status to in_progress when first action is added
         if follow_up_datetime:
             lead.next_follow_up_date = follow_up_datetime
+            db.session.flush()
+            db.session.add(FollowUpReminder(
+                action_id=action.id,
+                lead_id=lead.id,
+                admin_id=current_user.id,
+                due_at=follow_up_datetime
+            ))
         
         db.session.commit()
         
@@ -3033,24 +5664,10 @@ def add_lead_action(lead_id):
 def api_notifications():
     """Get user notifications"""
     try:
-        current_user = User.query.get(session['user_id'])
+        current_user = get_current_user()
         notifications = Notification.query.filter_by(user_id=current_user.id).order_by(Notification.created_at.desc()).limit(50).all()
         
-        result = []
-        for notification in notifications:
-            time_ago = get_time_ago(notification.created_at)
-            result.append({
-                'id': notification.id,
-                'type': notification.type,
-                'title': notification.title,
-                'message': notification.message,
-                'action_url': notification.action_url,
-                'is_read': notification.is_read,
-                'time_ago': time_ago,
-                'created_at': notification.created_at.isoformat()
-            })
-        
-        return jsonify(result)
+        return jsonify([serialize_notification(notification) for notification in notifications])
         
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -3060,24 +5677,35 @@ def api_notifications():
 def api_unread_count():
     """Get unread notification count"""
     try:
-        current_user = User.query.get(session['user_id'])
-        count = Notification.query.filter_by(user_id=current_user.id, is_read=False).count()
-        return jsonify({'count': count})
+        return jsonify({'count': count_unread_notifications(session['user_id'])})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@app.route('/api/notifications/stream')
+@limiter.exempt
+@login_required
+def api_notification_stream():
+    """Server-Sent Events: unread count on connect, then new notifications as they are created"""
+    user_id = session['user_id']
+    return event_stream_response(notification_channel(user_id), [
+        ('unread_count', {'count': count_unread_notifications(user_id)})
+    ])
+
 @app.route('/api/notifications/<int:notification_id>/mark-read', methods=['POST'])
 @login_required
 def mark_notification_read(notification_id):
     """Mark notification as read"""
     try:
-        current_user = User.query.get(session['user_id'])
+        current_user = get_current_user()
         notification = Notification.query.filter_by(id=notification_id, user_id=current_user.id).first()
         
         if notification:
+            was_unread = not notification.is_read
             notification.is_read = True
             db.session.commit()
+            if was_unread:
+                publish_unread_count(current_user.id)
             return jsonify({'success': True})
         else:
             return jsonify({'error': 'Notification not found'}), 404
@@ -3090,9 +5718,13 @@ def mark_notification_read(notification_id):
 def mark_all_notifications_read():
     """Mark all notifications as read"""
     try:
-        current_user = User.query.get(session['user_id'])
-        Notification.query.filter_by(user_id=current_user.id, is_read=False).update({'is_read': True})
+        current_user = get_current_user()
+        updated = Notification.query.filter_by(user_id=current_user.id, is_read=False).update({'is_read': True})
+        # Bulk UPDATE bypasses the rollup hook; adjust the unread counter in the same transaction
+        if updated:
+            apply_rollup_delta(db.session.connection(), NotificationUnreadCount, {'user_id': current_user.id}, {'unread_count': -updated})
         db.session.commit()
+        publish_unread_count(current_user.id)
         return jsonify({'success': True})
         
     except Exception as e:
@@ -3107,18 +5739,27 @@ def create_lead_from_activity(user_id, lead_source, estimated_value=0.0, notes=N
         if not user or user.is_admin:
             return None
             
-        # Check if a pending lead already exists for this user
-        existing_lead = Lead.query.filter_by(
-            company_id=user.id, 
-            status='pending'
-        ).first()
+        # Reuse the customer's open lead, whether still pending or already routed to an admin
+        existing_lead = Lead.query.filter(
+            Lead.company_id == user.id,
+            Lead.status.in_(('pending',) + OPEN_LEAD_STATUSES)
+        ).order_by(Lead.created_at.desc()).first()
         
         if existing_lead:
-            # Update existing lead with new activity
-            existing_lead.estimated_value += estimated_value
-            existing_lead.updated_at = datetime.utcnow()
-            if notes:
-                existing_lead.notes = f"{existing_lead.notes}\n\n{notes}" if existing_lead.notes else notes
+            # Append the activity and bump the running value in SQL (no read-modify-write)
+            db.session.execute(
+                db.update(Lead)
+                .where(Lead.id == existing_lead.id)
+                .values(estimated_value=db.func.coalesce(Lead.estimated_value, 0.0) + (estimated_value or 0.0),
+                        updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            db.session.add(LeadActivity(
+                lead_id=existing_lead.id,
+                lead_source=lead_source,
+                estimated_value=estimated_value,
+                notes=notes
+            ))
             db.session.commit()
             return existing_lead
         else:
@@ -3127,22 +5768,33 @@ def create_lead_from_activity(user_id, lead_source, estimated_value=0.0, notes=N
                 company_id=user.id,
                 lead_source=lead_source,
                 estimated_value=estimated_value,
-                notes=notes,
                 priority='medium'
             )
+            
+            # Give the lead an owner straight away
+            owners = pick_lead_owners() if app.config['LEAD_AUTO_ROUTING'] else []
+            assign_leads([lead], owners)
+            
             db.session.add(lead)
-            db.session.commit()
+            db.session.flush()
+            db.session.add(LeadActivity(
+                lead_id=lead.id,
+                lead_source=lead_source,
+                estimated_value=estimated_value,
+                notes=notes
+            ))
             
             # Create notifications for all admins
-            admin_users = User.query.filter(User.is_admin == True).all()
-            for admin in admin_users:
-                create_notification(
-                    user_id=admin.id,
-                    type='new_lead',
-                    title=f'New Lead: {user.company_name}',
-                    message=f'New {lead_source.replace("_", " ")} lead from {user.company_name}',
-                    action_url=f'/admin/crm/lead/{lead.id}'
-                )
+            admin_ids = db.session.scalars(db.select(User.id).where(User.is_admin == True)).all()
+            create_notifications_bulk([{
+                'user_id': admin_id,
+                'type': 'new_lead',
+                'title': f'New Lead: {user.company_name}',
+                'message': f'New {lead_source.replace("_", " ")} lead from {user.company_name}',
+                'action_url': f'/admin/crm/lead/{lead.id}'
+            } for admin_id in admin_ids])
+            if lead.assigned_admin_id:
+                notify_lead_assignments([lead])
             
             # Send email notification to admins
             EmailService.send_admin_notification(
@@ -3154,6 +5806,7 @@ def create_lead_from_activity(user_id, lead_source, estimated_value=0.0, notes=N
                     'lead_url': f'http://127.0.0.1:5000/admin/crm/lead/{lead.id}'
                 }
             )
+            db.session.commit()
             
             return lead
             
@@ -3173,11 +5826,278 @@ def create_notification(user_id, type, title, message, action_url=None):
         )
         db.session.add(notification)
         db.session.commit()
+        publish_notification(notification)
         return notification
     except Exception as e:
         print(f"Error creating notification: {e}")
         return None
 
+def create_notifications_bulk(notifications):
+    """Create many notifications with one multi-row INSERT in the caller's transaction
+    
+    notifications is a list of dicts with user_id, type, title, message and optional
+    action_url. The unread counters are bumped once per user. The caller commits, and
+    the new rows are published to their users' streams once that commit succeeds.
+    """
+    if not notifications:
+        return []
+    
+    now = datetime.utcnow()
+    rows = [{
+        'user_id': notification['user_id'],
+        'type': notification['type'],
+        'title': notification['title'],
+        'message': notification['message'],
+        'action_url': notification.get('action_url'),
+        'is_read': False,
+        'created_at': now
+    } for notification in notifications]
+    created = db.session.scalars(db.insert(Notification).returning(Notification), rows).all()
+    
+    # Bulk INSERT bypasses the rollup hook
+    unread_by_user = {}
+    for row in rows:
+        unread_by_user[row['user_id']] = unread_by_user.get(row['user_id'], 0) + 1
+    apply_rollup_deltas(db.session.connection(), NotificationUnreadCount, [
+        ({'user_id': user_id}, {'unread_count': count}) for user_id, count in unread_by_user.items()
+    ])
+    
+    # Serialize now: the caller's commit expires the objects
+    events = [(notification.user_id, serialize_notification(notification)) for notification in created]
+    def publish_created():
+        for user_id, data in events:
+            event_broker.publish(notification_channel(user_id), 'notification', data)
+    run_after_commit(publish_created)
+    return created
+
+NOTIFICATION_RETENTION_ACTIONS = ('archive', 'delete', 'keep')
+
+def get_notification_retention_policies():
+    """Return ({type: (action, days)}, default (action, days)) from the retention config"""
+    default_action = app.config['NOTIFICATION_RETENTION_ACTION'].strip()
+    if default_action not in NOTIFICATION_RETENTION_ACTIONS:
+        # A typo must never fall through to the delete branch: keep everything until it is fixed
+        app.logger.error(f"Invalid NOTIFICATION_RETENTION_ACTION {default_action!r}, expected one of "
+                         f"{', '.join(NOTIFICATION_RETENTION_ACTIONS)}; keeping notifications")
+        default_action = 'keep'
+    default_policy = (default_action, app.config['NOTIFICATION_RETENTION_DAYS'])
+    policies = {}
+    for entry in app.config['NOTIFICATION_RETENTION_POLICY'].split(','):
+        if not entry.strip():
+            continue
+        try:
+            notification_type, rule = entry.split('=', 1)
+            action, _, days = rule.partition(':')
+            action = action.strip()
+            if action not in NOTIFICATION_RETENTION_ACTIONS:
+                raise ValueError(action)
+            policies[notification_type.strip()] = (action, int(days) if days else default_policy[1])
+        except ValueError:
+            app.logger.error(f"Ignoring invalid notification retention policy entry: {entry!r}")
+    return policies, default_policy
+
+def prune_notifications(batch_size=None):
+    """Archive or delete old read notifications per type policy, in bounded batches
+    
+    Returns {'archived': n, 'deleted': n}. Unread notifications are never touched.
+    """
+    batch_size = batch_size or app.config['NOTIFICATION_RETENTION_BATCH_SIZE']
+    policies, default_policy = get_notification_retention_policies()
+    now = datetime.utcnow()
+    archive_columns = ['user_id', 'type', 'title', 'message', 'created_at']
+    totals = {'archived': 0, 'deleted': 0}
+    
+    # One pass per explicit type, then one for every other type under the default policy
+    passes = [(Notification.type == notification_type, policy) for notification_type, policy in policies.items()]
+    passes.append((Notification.type.notin_(list(policies)) if policies else db.true(), default_policy))
+    
+    for type_filter, (action, days) in passes:
+        if action == 'keep':
+            continue
+        cutoff = now - timedelta(days=days)
+        while True:
+            batch_ids = [row[0] for row in db.session.query(Notification.id).filter(
+                Notification.is_read == True,
+                Notification.created_at < cutoff,
+                type_filter
+            ).order_by(Notification.created_at, Notification.id).limit(batch_size).all()]
+            if not batch_ids:
+                break
+            
+            if action == 'archive':
+                db.session.execute(db.insert(NotificationArchive).from_select(
+                    ['notification_id'] + archive_columns + ['archived_at'],
+                    db.select(
+                        Notification.id, *[getattr(Notification, column) for column in archive_columns], db.literal(now)
+                    ).where(Notification.id.in_(batch_ids))
+                ))
+            db.session.execute(db.delete(Notification).where(Notification.id.in_(batch_ids)))
+            db.session.commit()
+            totals['archived' if action == 'archive' else 'deleted'] += len(batch_ids)
+            
+            if len(batch_ids) < batch_size:
+                break
+    return totals
+
+register_background_job('prune_notifications', 3600, prune_notifications)
+
+@app.cli.command('prune-notifications')
+def prune_notifications_command():
+    """Apply the notification retention policy now"""
+    totals = prune_notifications()
+    print(f"Archived {totals['archived']} and deleted {totals['deleted']} read notification(s)")
+
+# ================== EMAIL OUTBOX ==================
+# Web requests only insert EmailOutbox rows. This worker renders and sends them in
+# batches over one SMTP connection that is kept open between runs until it idles out.
+
+smtp_state = {'connection': None, 'last_used': 0.0}
+
+def get_smtp_connection():
+    """Open SMTP connection, reused across batches until EMAIL_SMTP_IDLE_SECONDS pass unused"""
+    if smtp_state['connection'] is not None and \
+            time.monotonic() - smtp_state['last_used'] > app.config['EMAIL_SMTP_IDLE_SECONDS']:
+        close_smtp_connection()
+    if smtp_state['connection'] is None:
+        smtp_state['connection'] = EmailService.get_mail().connect().__enter__()
+    smtp_state['last_used'] = time.monotonic()
+    return smtp_state['connection']
+
+def close_smtp_connection():
+    connection, smtp_state['connection'] = smtp_state['connection'], None
+    if connection is not None:
+        try:
+            connection.__exit__(None, None, None)
+        except Exception:
+            pass  # Already dropped by the server
+
+def deliver_email(email, subject, html_content, text_content):
+    """Send one rendered outbox message (logged to the console outside production)"""
+    if os.getenv('FLASK_ENV') != 'production':
+        # Development mode - just log the email
+        print(f"\n{'='*60}")
+        print(f"📧 EMAIL NOTIFICATION (Development Mode)")
+        print(f"{'='*60}")
+        print(f"To: {email.to_email}")
+        print(f"Template: {email.template_name}")
+        print(f"Subject: {subject}")
+        print(f"{'='*60}\n")
+        return
+    
+    from flask_mail import Message
+    import smtplib
+    
+    EmailService.get_mail()  # Loads the MAIL_* settings
+    message = Message(
+        subject=subject,
+        recipients=[email.to_email],
+        html=html_content,
+        body=text_content,
+        sender=app.config['MAIL_DEFAULT_SENDER']
+    )
+    with track_outbound('smtp'):
+        try:
+            get_smtp_connection().send(message)
+        except smtplib.SMTPServerDisconnected:
+            # The kept-alive connection was closed by the server; reconnect once
+            close_smtp_connection()
+            get_smtp_connection().send(message)
+
+def deliver_email_outbox(batch_size=None):
+    """Send due outbox messages; failures are retried with exponential backoff"""
+    batch_size = batch_size or app.config['EMAIL_OUTBOX_BATCH_SIZE']
+    max_attempts = app.config['EMAIL_MAX_ATTEMPTS']
+    retry_base = app.config['EMAIL_RETRY_BASE_SECONDS']
+    totals = {'sent': 0, 'retried': 0, 'failed': 0}
+    
+    while True:
+        now = datetime.utcnow()
+        batch = EmailOutbox.query.filter(
+            EmailOutbox.status == 'pending',
+            EmailOutbox.next_attempt_at <= now
+        ).order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)\
+            .limit(batch_size).with_for_update(skip_locked=True).all()
+        if not batch:
+            break
+        
+        # Compile each template once per batch; None marks a template that does not exist
+        compiled_by_name = {}
+        for email in batch:
+            try:
+                if email.template_name not in compiled_by_name:
+                    # Savepoint: a failed lookup must not abort the batch's transaction
+                    with db.session.begin_nested():
+                        compiled_by_name[email.template_name] = EmailService.get_compiled_template(email.template_name)
+                compiled = compiled_by_name[email.template_name]
+                if compiled is None:
+                    # Retrying cannot help a missing template
+                    email.status = 'failed'
+                    email.last_error = f"Email template '{email.template_name}' not found"
+                    totals['failed'] += 1
+                    continue
+                # Bad variables or a render error only affect this message, and go through the backoff
+                rendered = EmailService.render_compiled(compiled, json.loads(email.template_vars or '{}'))
+                deliver_email(email, *rendered)
+                email.status = 'sent'
+                email.sent_at = now
+                totals['sent'] += 1
+            except Exception as e:
+                close_smtp_connection()
+                email.attempts += 1
+                email.last_error = str(e)[:1000]
+                if email.attempts >= max_attempts:
+                    email.status = 'failed'
+                    totals['failed'] += 1
+                    app.logger.error(f"Giving up on email {email.id} to {email.to_email}: {e}")
+                else:
+                    email.next_attempt_at = now + timedelta(seconds=min(retry_base * 2 ** (email.attempts - 1), 3600))
+                    totals['retried'] += 1
+        db.session.commit()
+        
+        if len(batch) < batch_size:
+            break
+    return totals
+
+register_background_job('deliver_email_outbox', app.config['EMAIL_OUTBOX_INTERVAL'], deliver_email_outbox)
+
+@app.cli.command('send-emails')
+def send_emails_command():
+    """Deliver every due message in the email outbox now"""
+    totals = deliver_email_outbox()
+    print(f"Sent {totals['sent']}, retrying {totals['retried']}, failed {totals['failed']}")
+
+def notification_channel(user_id):
+    return f'notifications:{user_id}'
+
+def serialize_notification(notification):
+    return {
+        'id': notification.id,
+        'type': notification.type,
+        'title': notification.title,
+        'message': notification.message,
+        'action_url': notification.action_url,
+        'is_read': notification.is_read,
+        'time_ago': get_time_ago(notification.created_at),
+        'created_at': notification.created_at.isoformat()
+    }
+
+def publish_notification(notification):
+    """Push a committed notification to the user's open notification streams"""
+    event_broker.publish(notification_channel(notification.user_id), 'notification', serialize_notification(notification))
+
+def count_unread_notifications(user_id):
+    """Unread count from the maintained counter (primary-key read)"""
+    counter = db.session.get(NotificationUnreadCount, user_id)
+    if counter and counter.unread_count < 0:
+        # Only a write that bypassed the rollup hook gets here; `flask rebuild-rollups` repairs it
+        app.logger.warning(f"Unread notification counter for user {user_id} is negative ({counter.unread_count})")
+        return 0
+    return counter.unread_count if counter else 0
+
+def publish_unread_count(user_id):
+    """Sync the unread badge in every open tab after notifications are read"""
+    event_broker.publish(notification_channel(user_id), 'unread_count', {'count': count_unread_notifications(user_id)})
+
 def get_time_ago(dt):
     """Get human-readable time ago string"""
     now = datetime.utcnow()
@@ -3272,7 +6192,7 @@ def quote_details(quote_id):
         quote = Quote.query.get_or_404(quote_id)
         
         # Check if user has access to this quote
-        current_user = User.query.get(session['user_id'])
+        current_user = get_current_user()
         if not current_user.is_admin and quote.user_id != current_user.id:
             return jsonify({'error': 'Access denied'}), 403
         
@@ -3301,8 +6221,8 @@ def reset_customer_password(user_id):
     """Reset password for trucking companies and vendors - Super Admin only"""
     try:
         # Check if current user is super admin
-        current_user = User.query.get(session['user_id'])
-        if not current_user or not current_user.is_admin or current_user.admin_role != 'super_admin':
+        current_user = get_current_user()
+        if not has_permission(PERM_MANAGE_ADMINS):
             return jsonify({'success': False, 'error': 'Super Admin access required'}), 403
         
         # Get the user to reset password for
@@ -3333,8 +6253,8 @@ def reset_admin_password(user_id):
     """Reset password for admin users - Super Admin only"""
     try:
         # Check if current user is super admin
-        current_user = User.query.get(session['user_id'])
-        if not current_user or not current_user.is_admin or current_user.admin_role != 'super_admin':
+        current_user = get_current_user()
+        if not has_permission(PERM_MANAGE_ADMINS):
             return jsonify({'success': False, 'error': 'Super Admin access required'}), 403
         
         # Get the admin user to reset password for
@@ -3374,8 +6294,8 @@ def invite_admin():
     """Create new admin user - Super Admin only"""
     try:
         # Check if current user is super admin
-        current_user = User.query.get(session['user_id'])
-        if not current_user or not current_user.is_admin or current_user.admin_role != 'super_admin':
+        current_user = get_current_user()
+        if not has_permission(PERM_MANAGE_ADMINS):
             return jsonify({'success': False, 'error': 'Super Admin access required'}), 403
         
         # Get data from request
@@ -3442,8 +6362,8 @@ def remove_admin(user_id):
     """Remove admin user - Super Admin only"""
     try:
         # Check if current user is super admin
-        current_user = User.query.get(session['user_id'])
-        if not current_user or not current_user.is_admin or current_user.admin_role != 'super_admin':
+        current_user = get_current_user()
+        if not has_permission(PERM_MANAGE_ADMINS):
             return jsonify({'success': False, 'error': 'Super Admin access required'}), 403
         
         # Get the admin user to remove
@@ -3478,8 +6398,8 @@ def remove_admin(user_id):
 def admin_management():
     """Admin Management page - Super Admin only"""
     # Check if current user is super admin
-    current_user = User.query.get(session['user_id'])
-    if not current_user or not current_user.is_admin or current_user.admin_role != 'super_admin':
+    current_user = get_current_user()
+    if not has_permission(PERM_MANAGE_ADMINS):
         flash('Super Admin access required')
         return redirect(url_for('admin_dashboard'))
     
@@ -3666,13 +6586,9 @@ def blog_category(category):
 # ================== ADMIN BLOG MANAGEMENT ROUTES ==================
 
 @app.route('/admin/blog')
-@login_required
+@admin_required
 def admin_blog_list():
     """Admin blog post management"""
-    if not session.get('is_admin'):
-        flash('Admin access required')
-        return redirect(url_for('dashboard'))
-    
     page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', '')
     category_filter = request.args.get('category', '')
@@ -3722,13 +6638,9 @@ def admin_blog_list():
                          stats=stats)
 
 @app.route('/admin/blog/new', methods=['GET', 'POST'])
-@login_required
+@admin_required
 def admin_blog_new():
     """Create new blog post"""
-    if not session.get('is_admin'):
-        flash('Admin access required')
-        return redirect(url_for('dashboard'))
-    
     if request.method == 'POST':
         try:
             # Get form data
@@ -3784,13 +6696,9 @@ def admin_blog_new():
     return render_template('admin/blog_form.html', post=None)
 
 @app.route('/admin/blog/<int:post_id>/edit', methods=['GET', 'POST'])
-@login_required
+@admin_required
 def admin_blog_edit(post_id):
     """Edit blog post"""
-    if not session.get('is_admin'):
-        flash('Admin access required')
-        return redirect(url_for('dashboard'))
-    
     post = BlogPost.query.get_or_404(post_id)
     
     if request.method == 'POST':
@@ -3859,7 +6767,7 @@ def admin_blog_edit(post_id):
 @login_required
 def admin_blog_delete(post_id):
     """Delete blog post"""
-    if not session.get('is_admin'):
+    if not has_permission(PERM_ANY_ADMIN):
         return jsonify({'success': False, 'error': 'Admin access required'}), 403
     
     try:
@@ -3881,7 +6789,7 @@ def admin_blog_delete(post_id):
 @login_required
 def admin_blog_toggle_status(post_id):
     """Toggle blog post status between draft and published"""
-    if not session.get('is_admin'):
+    if not has_permission(PERM_ANY_ADMIN):
         return jsonify({'success': False, 'error': 'Admin access required'}), 403
     
     try:
@@ -4006,9 +6914,13 @@ def internal_error(error):
     db.session.rollback()  # Rollback any pending database transactions
     return render_template('errors/500.html'), 500
 
+if app.config['ENABLE_BACKGROUND_JOBS']:
+    start_background_jobs()
+
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        # Tables, plus columns and indexes added after the tables were first created
+        upgrade_database()
         
         # Initialize email templates
         initialize_email_templates()
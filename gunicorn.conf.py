@@ -0,0 +1,30 @@
+# Gunicorn settings (loaded automatically from the project root)
+#
+# /metrics aggregates every worker through PROMETHEUS_MULTIPROC_DIR. Unless it is set, each
+# master gets its own directory under the system temp dir. The background worker process
+# serves its own metrics instead (WORKER_METRICS_PORT), so this directory is never shared.
+import os
+import shutil
+import tempfile
+
+from dotenv import load_dotenv
+
+# The hooks below run in the master before app.py is imported, so read .env here as well
+load_dotenv()
+
+if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = os.path.join(tempfile.gettempdir(), f'prometheus-gunicorn-{os.getpid()}')
+
+def on_starting(server):
+    """Set up what the workers inherit: the web worker count and an empty metrics directory"""
+    # app.py refuses the in-process event broker when more than one web worker runs
+    os.environ['WEB_PROCESS_COUNT'] = str(server.cfg.workers)
+    # Start without samples from a previous run (the directory belongs to this master alone)
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+def child_exit(server, worker):
+    """Let the metrics collector drop the live samples of a worker that exited"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
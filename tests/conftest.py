@@ -0,0 +1,7 @@
+import os
+import sys
+
+# app.py reads its configuration at import time: point it at a throwaway database first
+os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+os.environ['ENABLE_BACKGROUND_JOBS'] = 'False'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,128 @@
+"""EXPLAIN every hot query (HOT_QUERY_PLANS) against a seeded schema and fail on full table scans
+
+The SQLite tests run on an in-memory database. The PostgreSQL variant creates a throwaway
+schema in the database named by TEST_POSTGRES_URL and is skipped when that is not set.
+"""
+import os
+import uuid
+from datetime import datetime, date, timedelta
+
+import pytest
+import sqlalchemy as sa
+
+from app import (
+    app, db, HOT_QUERY_PLANS, explain_query,
+    User, SavedRoute, Quote, PilotCarOrder, Lead, LeadAction, BlogPost, Notification, AuditEvent
+)
+
+SEED_USERS = 50
+SEED_ROWS_PER_USER = 4
+
+hot_queries = pytest.mark.parametrize(
+    'name, build_statement', HOT_QUERY_PLANS, ids=[name for name, _ in HOT_QUERY_PLANS]
+)
+
+def seed(connection):
+    """Insert enough varied rows that the planner has a real choice to make"""
+    now = datetime(2025, 1, 15)
+    connection.execute(sa.insert(User.__table__), [
+        {'id': i, 'company_name': f'Company {i}', 'email': f'User{i}@Example.com',
+         'user_type': 'vendor' if i % 2 else 'trucking_company', 'is_approved': True}
+        for i in range(1, SEED_USERS + 1)
+    ])
+    per_user = [(user_id, n) for user_id in range(1, SEED_USERS + 1) for n in range(SEED_ROWS_PER_USER)]
+    connection.execute(sa.insert(SavedRoute.__table__), [
+        {'user_id': user_id, 'route_name': f'Route {n}', 'origin': 'Richmond, VA',
+         'destination': 'Dallas, TX', 'road_type': 'interstate', 'created_at': now - timedelta(days=n)}
+        for user_id, n in per_user
+    ])
+    connection.execute(sa.insert(Quote.__table__), [
+        {'user_id': user_id, 'pickup_date': date(2025, 2, 1), 'pickup_time': '08:00',
+         'pickup_location': 'Richmond', 'pickup_state': 'VA', 'delivery_location': 'Dallas',
+         'delivery_state': 'TX', 'car_types': '["Lead"]', 'created_at': now - timedelta(days=n)}
+        for user_id, n in per_user
+    ])
+    connection.execute(sa.insert(PilotCarOrder.__table__), [
+        {'user_id': user_id, 'company_name': f'Company {user_id}', 'pickup_address': 'Richmond, VA',
+         'delivery_address': 'Dallas, TX', 'pickup_date': date(2025, 2, 1), 'pickup_time': '08:00',
+         'pilot_car_positions': '["Lead"]', 'driver_name': 'Driver', 'driver_phone': '555-0100',
+         'length': '80', 'width': '12', 'height': '14', 'weight': '90000', 'contact_name': 'Contact',
+         'preferred_contact': 'phone', 'phone_number': '555-0100', 'email': f'user{user_id}@example.com',
+         'payment_method': 'credit_card', 'terms_agreed': True,
+         'status': ('pending', 'confirmed', 'completed', 'cancelled')[n],
+         'created_at': now - timedelta(days=n)}
+        for user_id, n in per_user
+    ])
+    connection.execute(sa.insert(Lead.__table__), [
+        {'id': index + 1, 'company_id': user_id, 'lead_source': 'quote_request',
+         'status': ('pending', 'assigned', 'in_progress', 'converted')[n], 'created_at': now - timedelta(days=n)}
+        for index, (user_id, n) in enumerate(per_user)
+    ])
+    connection.execute(sa.insert(LeadAction.__table__), [
+        {'lead_id': lead_id, 'admin_id': 1, 'action_type': 'call', 'subject': 'Follow up',
+         'follow_up_date': now + timedelta(days=lead_id % 60)}
+        for lead_id in range(1, len(per_user) + 1)
+    ])
+    connection.execute(sa.insert(BlogPost.__table__), [
+        {'title': f'Post {i}', 'slug': f'post-{i}', 'content': 'Body', 'author_id': 1,
+         'status': 'published' if i % 3 else 'draft', 'published_at': now - timedelta(days=i)}
+        for i in range(1, 61)
+    ])
+    connection.execute(sa.insert(Notification.__table__), [
+        {'user_id': user_id, 'type': 'new_lead', 'title': 'New lead', 'message': 'A new lead arrived',
+         'is_read': n % 2 == 0, 'created_at': now - timedelta(days=n)}
+        for user_id, n in per_user
+    ])
+    connection.execute(sa.insert(AuditEvent.__table__), [
+        {'user_id': user_id, 'action_type': 'login', 'action_description': 'Logged in',
+         'month_bucket': 202501, 'created_at': now - timedelta(days=n)}
+        for user_id, n in per_user
+    ])
+    connection.execute(sa.text('ANALYZE'))
+
+def assert_uses_indexes(connection, name, build_statement):
+    with connection.begin():
+        plan, full_scans = explain_query(connection, build_statement())
+    assert not full_scans, f"'{name}' falls back to a full table scan:\n" + '\n'.join(plan)
+
+@pytest.fixture(scope='module')
+def sqlite_connection():
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as connection:
+            seed(connection)
+        with db.engine.connect() as connection:
+            yield connection
+        db.drop_all()
+
+@pytest.fixture(scope='module')
+def postgres_connection():
+    url = os.environ.get('TEST_POSTGRES_URL')
+    if not url:
+        pytest.skip('TEST_POSTGRES_URL is not set')
+    engine = sa.create_engine(url)
+    schema = f'query_plans_{uuid.uuid4().hex[:8]}'
+    with engine.connect() as connection:
+        with connection.begin():
+            connection.execute(sa.text(f'CREATE SCHEMA {schema}'))
+        try:
+            # Unqualified names (tables, indexes, EXPLAIN) all resolve to the throwaway schema
+            connection.execute(sa.text(f'SET search_path TO {schema}'))
+            connection.commit()
+            with connection.begin():
+                db.metadata.create_all(connection)
+                seed(connection)
+            yield connection
+        finally:
+            connection.rollback()
+            with connection.begin():
+                connection.execute(sa.text(f'DROP SCHEMA {schema} CASCADE'))
+    engine.dispose()
+
+@hot_queries
+def test_sqlite_hot_query_uses_index(sqlite_connection, name, build_statement):
+    assert_uses_indexes(sqlite_connection, name, build_statement)
+
+@hot_queries
+def test_postgres_hot_query_uses_index(postgres_connection, name, build_statement):
+    assert_uses_indexes(postgres_connection, name, build_statement)